@@ -1,4 +1,8 @@
 # src/audio_capture.py
+import threading
+import time
+from collections import deque
+
 import pyaudio
 
 # Audio stream parameters
@@ -18,3 +22,39 @@ def get_audio_stream():
         frames_per_buffer=CHUNK
     )
     return stream, p
+
+
+class BackgroundRecorder(threading.Thread):
+    """
+    Reads CHUNK-sized frames from a stream on a background thread and keeps the
+    most recent max_seconds of audio, so analysis can continue while the main
+    thread is busy generating.
+    """
+
+    def __init__(self, stream, max_seconds=15):
+        super().__init__(daemon=True)
+        self.stream = stream
+        self.frames = deque(maxlen=int(RATE / CHUNK * max_seconds))
+        self.end_time = None  # time.monotonic() when the newest frame arrived
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            audio_data = self.stream.read(CHUNK, exception_on_overflow=False)
+            now = time.monotonic()
+            with self._lock:
+                self.frames.append(audio_data)
+                self.end_time = now
+
+    def latest(self, duration_sec):
+        """Returns (audio bytes of the last duration_sec seconds, time of their end)."""
+        num_frames = int(RATE / CHUNK * duration_sec)
+        with self._lock:
+            frames = list(self.frames)[-num_frames:]
+            end_time = self.end_time
+        return b"".join(frames), end_time
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
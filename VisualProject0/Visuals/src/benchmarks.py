@@ -0,0 +1,308 @@
+# src/benchmarks.py
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+from generator import (load_diffusion_model, generate_image, bfloat16_supported, quantize_pipeline,
+                       save_quantized_components, load_quantized_components, DeadlineModel,
+                       PeakMemory, _rss_mb)
+
+PROMPT = "A depiction of a raw spirit evoking ancient, carved symbols"
+
+
+def seconds_per_step(pipe, prompt=PROMPT, steps=5, repeats=2, **kwargs):
+    """
+    Measures the denoising cost per step, excluding fixed costs (text encoding,
+    VAE decode) by timing a 1-step and an N-step run and taking the difference.
+    """
+    def best_time(n):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            generate_image(pipe, prompt, num_inference_steps=n, **kwargs)
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    generate_image(pipe, prompt, num_inference_steps=1, **kwargs)  # warm-up
+    return (best_time(steps) - best_time(1)) / (steps - 1)
+
+
+def benchmark_cpu_profiles(model_name="CompVis/stable-diffusion-v1-4", threads=None,
+                           compile=False, steps=5):
+    """
+    Prints seconds per step on the CPU for each combination of the
+    optimize_for_cpu options, starting with the untuned float32 baseline.
+    """
+    bf16_options = [False, True] if bfloat16_supported() else [False]
+    compile_options = [False, True] if compile else [False]
+    combos = [None] + list(itertools.product([False, True], ["default", "sliced", "sdpa"],
+                                             bf16_options, compile_options))
+    baseline = None
+    print(f"{'channels_last':>13} {'attention':>9} {'bf16':>5} {'compile':>7} {'s/step':>8} {'speed-up':>8}")
+    for combo in combos:
+        if combo is None:
+            profile = None
+            label = f"{'baseline (float32, defaults)':>38}"
+        else:
+            channels_last, attention, bfloat16, compiled = combo
+            profile = {"threads": threads, "channels_last": channels_last, "attention": attention,
+                       "bfloat16": bfloat16, "compile": compiled}
+            label = f"{str(channels_last):>13} {attention:>9} {str(bfloat16):>5} {str(compiled):>7}"
+        pipe = load_diffusion_model(model_name, device="cpu", cpu_profile=profile)
+        sps = seconds_per_step(pipe, steps=steps)
+        baseline = baseline or sps
+        print(f"{label} {sps:8.3f} {baseline / sps:7.2f}x")
+        del pipe
+
+
+def benchmark_resolutions(model_name="CompVis/stable-diffusion-v1-4", output_size=512, steps=20,
+                          sizes=(256, 320, 384, 448, 512), methods=("fast", "balanced", "best", "latent")):
+    """
+    Prints generation latency against render resolution, each upscaled to
+    output_size with every upscale method, next to the native-size baseline.
+    """
+    pipe = load_diffusion_model(model_name)
+    generate_image(pipe, PROMPT, num_inference_steps=1, size=sizes[0])  # warm-up
+    print(f"{'render':>7} {'method':>9} {'seconds':>8} {'vs native':>9}")
+    native = None
+    for size in sorted(sizes, reverse=True):
+        for method in (methods if size != output_size else ("fast",)):
+            start = time.perf_counter()
+            generate_image(pipe, PROMPT, num_inference_steps=steps, output_type="np", size=size,
+                           upscale_to=(output_size, output_size), upscale_method=method)
+            elapsed = time.perf_counter() - start
+            if size == output_size:
+                native = elapsed
+                method = "native"
+            ratio = f"{native / elapsed:8.2f}x" if native else f"{'-':>9}"
+            print(f"{size:>5}px {method:>9} {elapsed:8.2f} {ratio}")
+
+
+def build_local_pipeline(scale=4, directory=None):
+    """
+    Constructs a small randomly initialised Stable Diffusion pipeline locally
+    (no download), with the same component types as the real model, so
+    benchmarks can compare variants on any machine. `scale` multiplies the
+    channel and hidden sizes.
+    """
+    from diffusers import AutoencoderKL, DDIMScheduler, StableDiffusionPipeline, UNet2DConditionModel
+    from transformers import CLIPTextConfig, CLIPTextModel, CLIPTokenizer
+
+    torch.manual_seed(0)
+    channels = 32 * scale
+    unet = UNet2DConditionModel(
+        block_out_channels=(channels, 2 * channels), layers_per_block=2, sample_size=32,
+        in_channels=4, out_channels=4, cross_attention_dim=channels,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+    )
+    vae = AutoencoderKL(
+        block_out_channels=(32, 64), in_channels=3, out_channels=3, latent_channels=4,
+        down_block_types=("DownEncoderBlock2D",) * 2, up_block_types=("UpDecoderBlock2D",) * 2,
+    )
+    text_encoder = CLIPTextModel(CLIPTextConfig(
+        bos_token_id=0, eos_token_id=1, pad_token_id=1, hidden_size=channels,
+        intermediate_size=4 * channels, num_attention_heads=4, num_hidden_layers=4, vocab_size=1000,
+    ))
+
+    # A character-level tokenizer: letters only, no merges.
+    directory = directory or tempfile.mkdtemp()
+    vocab = {"<|startoftext|>": 0, "<|endoftext|>": 1}
+    for c in "abcdefghijklmnopqrstuvwxyz":
+        vocab[c] = len(vocab)
+        vocab[c + "</w>"] = len(vocab)
+    with open(os.path.join(directory, "vocab.json"), "w") as f:
+        json.dump(vocab, f)
+    with open(os.path.join(directory, "merges.txt"), "w") as f:
+        f.write("#version: 0.2\n")
+    tokenizer = CLIPTokenizer(os.path.join(directory, "vocab.json"), os.path.join(directory, "merges.txt"))
+
+    return StableDiffusionPipeline(
+        vae=vae, text_encoder=text_encoder, tokenizer=tokenizer, unet=unet,
+        scheduler=DDIMScheduler(), safety_checker=None, feature_extractor=None,
+        requires_safety_checker=False,
+    )
+
+
+def _render(pipe, steps, size, seed=0):
+    return pipe(PROMPT, num_inference_steps=steps, height=size, width=size, output_type="np",
+                generator=torch.Generator().manual_seed(seed)).images[0]
+
+
+def _measure_quantization(variant, scale, steps, size, repeats, cache_dir, results):
+    """
+    Runs in a fresh process per variant, so each one's resident memory is its
+    own: loads the pipeline (int8 from the persisted artefact) and renders.
+    Building the float32 pipeline and applying the artefact are timed apart.
+    """
+    before_mb = _rss_mb()
+    artefact_seconds = None
+    with PeakMemory() as load_peak:
+        start = time.perf_counter()
+        pipe = build_local_pipeline(scale)
+        build_seconds = time.perf_counter() - start
+        if variant == "int8":
+            start = time.perf_counter()
+            if not load_quantized_components(pipe, cache_dir, "local"):
+                raise RuntimeError(f"no quantized artefact in {cache_dir}")
+            artefact_seconds = time.perf_counter() - start
+    resident_mb = _rss_mb()
+
+    _render(pipe, 1, size)  # warm-up
+    times = []
+    generate_peaks = []
+    for _ in range(repeats):
+        with PeakMemory() as peak:
+            start = time.perf_counter()
+            image = _render(pipe, steps, size)
+            times.append(time.perf_counter() - start)
+        generate_peaks.append(peak.peak_mb)
+
+    def above_baseline(mb):
+        return None if mb is None or before_mb is None else mb - before_mb
+
+    results.put((variant, {
+        "seconds": min(times), "build_seconds": build_seconds,
+        "artefact_seconds": artefact_seconds, "resident_mb": above_baseline(resident_mb),
+        "load_peak_mb": above_baseline(load_peak.peak_mb),
+        "generate_peak_mb": above_baseline(None if None in generate_peaks else max(generate_peaks)),
+    }, image))
+
+
+def _format_mb(mb, width):
+    return f"{'n/a':>{width}}" if mb is None else f"{mb:{width}.1f}"
+
+
+def benchmark_quantization(scale=4, steps=10, size=128, repeats=3):
+    """
+    Compares dynamic int8 quantization against the float32 baseline on a
+    locally constructed pipeline: generation time, resident memory after
+    loading, peak memory while loading and while generating (each relative
+    to the process before loading), build time, artefact load time against
+    quantizing from float32, and how close the int8 images stay to the
+    float32 ones (PSNR, mean absolute error).
+    """
+    import multiprocessing as mp
+
+    start = time.perf_counter()
+    quantized = quantize_pipeline(build_local_pipeline(scale))
+    quantize_seconds = time.perf_counter() - start
+
+    context = mp.get_context("spawn")
+    results = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        save_quantized_components(quantized, cache_dir, "local")
+        del quantized
+        for variant in ("float32", "int8"):
+            channel = context.Queue()
+            process = context.Process(target=_measure_quantization,
+                                      args=(variant, scale, steps, size, repeats, cache_dir, channel))
+            process.start()
+            name, measured, image = channel.get()
+            process.join()
+            results[name] = (measured, image)
+
+    print(f"{'variant':>8} {'seconds':>8} {'speed-up':>8} {'build s':>7} {'artefact s':>10} {'RSS MB':>7} "
+          f"{'load peak':>9} {'gen peak':>8}")
+    base_time = results["float32"][0]["seconds"]
+    for name, (m, _) in results.items():
+        print(f"{name:>8} {m['seconds']:8.3f} {base_time / m['seconds']:7.2f}x {m['build_seconds']:7.2f} "
+              f"{'n/a' if m['artefact_seconds'] is None else format(m['artefact_seconds'], '.2f'):>10} "
+              f"{_format_mb(m['resident_mb'], 7)} {_format_mb(m['load_peak_mb'], 9)} "
+              f"{_format_mb(m['generate_peak_mb'], 8)}")
+    a, b = results["float32"][1], results["int8"][1]
+    mse = float(np.mean((a - b) ** 2))
+    psnr = 10 * np.log10(1.0 / mse) if mse > 0 else float("inf")
+    print(f"int8 vs float32 image: PSNR {psnr:.1f} dB, mean abs error {np.mean(np.abs(a - b)):.4f}")
+    print(f"quantizing from float32 took {quantize_seconds:.2f} s, "
+          f"loading the artefact {results['int8'][0]['artefact_seconds']:.2f} s")
+
+
+def benchmark_pool_scaling(model_name="local", images=16, steps=10, size=256):
+    """
+    Prints images per minute for every split of the cores into generation
+    pool workers x intra-op threads (1 x all cores down to one core each).
+    "local" uses the small pipeline from build_local_pipeline.
+    """
+    from generation_pool import GenerationPool, split_cores
+
+    cores = len(split_cores(1)[0])
+    # Load once; the parent never runs inference, so every pool can fork from it.
+    pipe = build_local_pipeline() if model_name == "local" else load_diffusion_model(model_name, device="cpu")
+    splits = [w for w in (1, 2, 3, 4, 6, 8, 12, 16, 24, 32) if w <= cores and cores % w == 0]
+    print(f"{'workers':>7} {'threads':>7} {'img/min':>8} {'s/img':>7} {'speed-up':>8}")
+    baseline = None
+    for workers in splits:
+        with GenerationPool(pipe, workers=workers) as pool:
+            # One warm-up image per worker, then the timed batch.
+            for future in [pool.submit(PROMPT, num_inference_steps=1, size=size) for _ in range(workers)]:
+                future.result()
+            start = time.perf_counter()
+            futures = [pool.submit(PROMPT, num_inference_steps=steps, size=size) for _ in range(images)]
+            for future in futures:
+                future.result()
+            elapsed = time.perf_counter() - start
+        latency = sum(future.seconds for future in futures) / images
+        per_minute = images * 60 / elapsed
+        baseline = baseline or per_minute
+        print(f"{workers:>7} {cores // workers:>7} {per_minute:8.1f} {latency:7.2f} {per_minute / baseline:7.2f}x")
+
+
+def benchmark_deadlines(model_name="local", images=10, max_steps=50, deadlines=(2.0, 4.0, 8.0)):
+    """
+    Runs a series of deadline-mode generations per deadline and prints the
+    hit rate, lateness and step counts achieved. Costs are learned in memory
+    only, so the first images of the first deadline show the cold start.
+    """
+    pipe = build_local_pipeline() if model_name == "local" else load_diffusion_model(model_name)
+    pipe.deadline_model = DeadlineModel(filename=None)
+    print(f"{'deadline':>8} {'hit rate':>8} {'late s':>7} {'steps':>6} {'min':>4} {'max':>4} {'reduced':>7}")
+    for deadline in deadlines:
+        pipe.deadline_model.results.clear()
+        for _ in range(images):
+            generate_image(pipe, PROMPT, num_inference_steps=max_steps, output_type="np", deadline=deadline)
+        report = pipe.deadline_model.report()
+        print(f"{deadline:7.1f}s {report['hit_rate']:8.0%} {report['mean_lateness']:7.2f} "
+              f"{report['steps_mean']:6.1f} {report['steps_min']:>4} {report['steps_max']:>4} "
+              f"{report['reduced']:>7}")
+
+
+def _flag(value):
+    """Parses a command-line boolean; bool("False") would be True."""
+    if value.lower() in ("1", "true", "yes", "on"):
+        return True
+    if value.lower() in ("0", "false", "no", "off"):
+        return False
+    raise ValueError(f"expected true or false, got {value!r}")
+
+
+def _list(convert):
+    """Parses a comma-separated command-line list."""
+    return lambda value: tuple(convert(item) for item in value.split(","))
+
+
+if __name__ == "__main__":
+    # Usage: python benchmarks.py cpu [MODEL_NAME] [THREADS] [COMPILE true|false] [STEPS]
+    #        python benchmarks.py resolution [MODEL_NAME] [OUTPUT_SIZE] [STEPS] [SIZE,SIZE,...] [METHOD,...]
+    #        python benchmarks.py quantization [SCALE] [STEPS] [SIZE]
+    #        python benchmarks.py pool [MODEL_NAME|local] [IMAGES] [STEPS] [SIZE]
+    #        python benchmarks.py deadline [MODEL_NAME|local] [IMAGES] [MAX_STEPS] [SECONDS,SECONDS,...]
+    # Each benchmark lists a converter per positional argument.
+    benchmarks = {
+        "cpu": (benchmark_cpu_profiles, (str, int, _flag, int)),
+        "resolution": (benchmark_resolutions, (str, int, int, _list(int), _list(str))),
+        "quantization": (benchmark_quantization, (int, int, int)),
+        "pool": (benchmark_pool_scaling, (str, int, int, int)),
+        "deadline": (benchmark_deadlines, (str, int, int, _list(float))),
+    }
+    function, converters = benchmarks[sys.argv[1]]
+    args = sys.argv[2:]
+    if len(args) > len(converters):
+        sys.exit(f"{sys.argv[1]} takes at most {len(converters)} arguments")
+    function(*[convert(arg) for convert, arg in zip(converters, args)])
@@ -0,0 +1,303 @@
+# src/feature_bus.py
+import sys
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from multiprocessing import shared_memory
+
+DEFAULT_NAME = "visuals_feature_bus"
+RING_SIZE = 256
+NUM_BANDS = 8
+
+# Values stored per update, in slot order.
+FIELDS = (
+    "timestamp", "amplitude", "normalized_amplitude", "spectral_centroid",
+    *(f"band{i}" for i in range(NUM_BANDS)),
+    "low_energy", "bpm", "beat_phase", "beat_time",
+)
+_INDEX = {name: i for i, name in enumerate(FIELDS)}
+_BANDS = slice(_INDEX["band0"], _INDEX["band0"] + NUM_BANDS)
+
+# Header: latest published sequence number, ring size, field count, layout version.
+_HEADER = 4
+_LATEST, _RING, _NFIELDS, _VERSION = range(_HEADER)
+VERSION = 1
+
+# Buses created by this process (or the process it was forked from), whose
+# registration with the shared resource tracker must be left alone.
+_created = set()
+
+
+def _layout(buf, ring_size):
+    """Views of a bus buffer: (header, per-slot sequence numbers, slot data)."""
+    header = np.ndarray((_HEADER,), dtype=np.int64, buffer=buf)
+    slot_seq = np.ndarray((ring_size,), dtype=np.int64, buffer=buf, offset=_HEADER * 8)
+    data = np.ndarray((ring_size, len(FIELDS)), dtype=np.float64, buffer=buf,
+                      offset=(_HEADER + ring_size) * 8)
+    return header, slot_seq, data
+
+
+def _attach(name):
+    """
+    Attaches to an existing block without registering it with this process's
+    resource tracker, which would unlink the bus when a subscriber exits (Python < 3.13).
+
+    Before Python 3.13 attaching always registers, so the registration is
+    undone again, except for a bus created by this process or the one it was
+    forked from: they share one tracker, and undoing it would drop the
+    creator's own registration.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        block = shared_memory.SharedMemory(name=name)
+        if name not in _created:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(block._name, "shared_memory")
+        return block
+
+
+def _to_features(values):
+    features = {name: float(values[i]) for name, i in _INDEX.items() if not name.startswith("band")}
+    features["frequency_bands"] = values[_BANDS].tolist()
+    return features
+
+
+class FeaturePublisher:
+    """
+    Single writer of the feature bus: a ring of slots in shared memory, each
+    guarded by its own sequence number (a seqlock), so readers never take a lock.
+
+    Writing update n marks its slot 2n-1 (in progress), fills it, marks it 2n
+    (complete) and only then advances the header's latest sequence to n.
+
+    Args:
+      name (str): Name of the shared memory block.
+      ring_size (int): Number of slots.
+      replace (bool): Take over a bus that already exists under this name
+        (left behind by a publisher that crashed). By default that raises,
+        since it may belong to a publisher that is still running.
+    """
+
+    def __init__(self, name=DEFAULT_NAME, ring_size=RING_SIZE, replace=False):
+        size = (_HEADER + ring_size + ring_size * len(FIELDS)) * 8
+        try:
+            self.block = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            if not replace:
+                raise RuntimeError(f"A feature bus named {name!r} already exists; if its publisher "
+                                   f"is no longer running, take it over with: python feature_bus.py "
+                                   f"{name} --replace")
+            stale = _attach(name)
+            stale.unlink()
+            stale.close()
+            self.block = shared_memory.SharedMemory(name=name, create=True, size=size)
+        _created.add(name)
+        self.name = name
+        self.ring_size = ring_size
+        self._header, self._slot_seq, self._data = _layout(self.block.buf, ring_size)
+        self._slot_seq[:] = 0
+        self._header[:] = (0, ring_size, len(FIELDS), VERSION)
+        self.seq = 0
+
+    def publish(self, features):
+        """Publishes a feature dict (missing fields are written as 0) and returns its sequence number."""
+        values = np.zeros(len(FIELDS))
+        for name, i in _INDEX.items():
+            if name in features:
+                values[i] = features[name]
+        values[_BANDS] = features.get("frequency_bands", [0] * NUM_BANDS)
+        if "timestamp" not in features:
+            values[_INDEX["timestamp"]] = time.monotonic()
+
+        n = self.seq + 1
+        slot = n % self.ring_size
+        self._slot_seq[slot] = 2 * n - 1
+        self._data[slot] = values
+        self._slot_seq[slot] = 2 * n
+        self._header[_LATEST] = n
+        self.seq = n
+        return n
+
+    def close(self):
+        del self._header, self._slot_seq, self._data
+        self.block.close()
+        self.block.unlink()
+        _created.discard(self.name)
+
+
+class FeatureSubscriber:
+    """
+    Lock-free reader of the feature bus. Any number of processes can
+    subscribe; reads retry if the writer laps the slot mid-copy.
+    """
+
+    def __init__(self, name=DEFAULT_NAME):
+        try:
+            self.block = _attach(name)
+        except FileNotFoundError:
+            raise RuntimeError(f"No feature bus named {name!r}; start it with: python feature_bus.py")
+        header = np.ndarray((_HEADER,), dtype=np.int64, buffer=self.block.buf)
+        if header[_VERSION] != VERSION or header[_NFIELDS] != len(FIELDS):
+            raise RuntimeError(f"Feature bus {name!r} has an incompatible layout")
+        self.ring_size = int(header[_RING])
+        del header
+        self._header, self._slot_seq, self._data = _layout(self.block.buf, self.ring_size)
+        self.last_seq = 0
+
+    @property
+    def seq(self):
+        """Sequence number of the newest update (0 before the first)."""
+        return int(self._header[_LATEST])
+
+    def _read(self, n, spins=10000):
+        """Copies update n out of its slot, or returns None if it was overwritten."""
+        slot = n % self.ring_size
+        for _ in range(spins):
+            before = int(self._slot_seq[slot])
+            if before > 2 * n:
+                return None  # lapped by the writer
+            if before != 2 * n:
+                continue  # being written right now
+            values = self._data[slot].copy()
+            if int(self._slot_seq[slot]) == before:
+                return values
+        return None  # the writer stopped mid-update
+
+    def latest(self):
+        """The newest update as a feature dict (with its "seq"), or None before the first."""
+        while True:
+            n = self.seq
+            if n == 0:
+                return None
+            values = self._read(n)
+            if values is None and self.seq == n:
+                return None
+            if values is not None:
+                self.last_seq = n
+                features = _to_features(values)
+                features["seq"] = n
+                return features
+
+    def wait_next(self, timeout=1.0, poll=0.001):
+        """Waits (by polling, never locking) for an update newer than the last one read."""
+        deadline = time.monotonic() + timeout
+        while self.seq <= self.last_seq:
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(poll)
+        return self.latest()
+
+    def recent(self, seconds):
+        """Every update still in the ring from the last `seconds` seconds, oldest first."""
+        n = self.seq
+        rows = []
+        newest = None
+        for k in range(n, max(0, n - self.ring_size + 1), -1):
+            values = self._read(k)
+            if values is None:
+                break
+            newest = newest if newest is not None else values[_INDEX["timestamp"]]
+            if values[_INDEX["timestamp"]] < newest - seconds:
+                break
+            rows.append(values)
+        return rows[::-1]
+
+    def average(self, seconds):
+        """
+        Features averaged over the last `seconds` seconds, for consumers that
+        work on longer windows (like the diffusion loops); tempo fields are the latest.
+        """
+        rows = self.recent(seconds)
+        if not rows:
+            return None
+        features = _to_features(np.mean(rows, axis=0))
+        for name in ("timestamp", "bpm", "beat_phase", "beat_time"):
+            features[name] = float(rows[-1][_INDEX[name]])
+        return features
+
+    def close(self):
+        del self._header, self._slot_seq, self._data
+        self.block.close()
+
+
+def analyse_chunk(audio_data, sr):
+    """
+    Computes every published feature for one chunk of 16-bit PCM, so each
+    visualizer gets what it used to compute itself: the raw amplitude (hue
+    loop), the normalized amplitude, centroid and bands (diffusion loops) and
+    the low-frequency energy (particle visualizer).
+    """
+    from feature_extraction2 import extract_features
+
+    audio_np = np.frombuffer(audio_data, dtype=np.int16).astype(np.float32)
+    features = extract_features(audio_data, sr=sr)
+    features["normalized_amplitude"] = features["amplitude"]
+    features["amplitude"] = float(np.abs(audio_np).mean())
+    spectrum = np.abs(np.fft.rfft(audio_np / 32768.0))
+    freqs = np.fft.rfftfreq(len(audio_np), 1.0 / sr)
+    features["low_energy"] = float(spectrum[(freqs >= 40) & (freqs <= 215)].mean())
+    return features
+
+
+def run_analysis(name=DEFAULT_NAME, tempo_window=10, tempo_interval=1.0, replace=False):
+    """
+    The single analysis process: reads the audio input once, computes features
+    per chunk and publishes them, while a background thread keeps BPM and beat
+    phase up to date from the last tempo_window seconds. replace takes over a
+    bus left behind by a crashed publisher (see FeaturePublisher).
+    """
+    from audio_capture import get_audio_stream, CHUNK, RATE
+    from scheduler import BeatClock, estimate_tempo
+
+    bus = FeaturePublisher(name, replace=replace)
+    stream, p = get_audio_stream()
+    clock = BeatClock()
+    history = deque(maxlen=int(RATE / CHUNK * tempo_window))
+    history_lock = threading.Lock()
+    stop = threading.Event()
+
+    def track_tempo():
+        # Beat tracking takes far longer than a chunk, so it must not run on the read loop.
+        while not stop.wait(tempo_interval):
+            with history_lock:
+                if len(history) < history.maxlen:
+                    continue
+                audio_data = b"".join(history)
+                end_time = time.monotonic()
+            bpm, last_beat_offset = estimate_tempo(audio_data, sr=RATE)
+            if bpm > 0:
+                clock.update(bpm, end_time - last_beat_offset)
+
+    tempo_thread = threading.Thread(target=track_tempo, daemon=True)
+    tempo_thread.start()
+    print(f"Publishing features on {name!r}. Press Ctrl+C to stop.")
+    try:
+        while True:
+            audio_data = stream.read(CHUNK, exception_on_overflow=False)
+            now = time.monotonic()
+            with history_lock:
+                history.append(audio_data)
+            features = analyse_chunk(audio_data, RATE)
+            features["timestamp"] = now
+            features["bpm"] = clock.bpm
+            features["beat_phase"] = clock.beat_phase(now)
+            features["beat_time"] = clock.anchor or 0.0
+            bus.publish(features)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        tempo_thread.join()
+        stream.stop_stream()
+        stream.close()
+        p.terminate()
+        bus.close()
+
+
+if __name__ == "__main__":
+    # Usage: python feature_bus.py [BUS_NAME] [--replace]
+    args = [arg for arg in sys.argv[1:] if arg != "--replace"]
+    run_analysis(*args[:1], replace="--replace" in sys.argv[1:])
@@ -0,0 +1,526 @@
+# src/frame_server.py
+import base64
+import hashlib
+import itertools
+import json
+import socket
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+import numpy as np
+
+# Quality level -> (JPEG quality, maximum width in pixels or None for full size).
+QUALITY_LEVELS = {
+    "high": (90, None),
+    "medium": (75, 960),
+    "low": (50, 480),
+}
+DEFAULT_QUALITY = "high"
+BOUNDARY = "frame"
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+# Seconds a client's socket may block on one write before it is dropped.
+SEND_TIMEOUT = 10.0
+# WebSocket opcodes the server sends or answers.
+WS_BINARY, WS_CLOSE, WS_PING, WS_PONG = 0x2, 0x8, 0x9, 0xA
+# Largest client message read; the viewer only ever sends control frames.
+WS_MAX_MESSAGE = 1 << 16
+
+INDEX_PAGE = """<!doctype html>
+<html><head><title>Visuals</title>
+<style>body{margin:0;background:#000}img{width:100vw;height:100vh;object-fit:contain}</style></head>
+<body><img id="view" src="/stream.mjpg?quality=%(quality)s">
+<script>
+// With ?ws in the page URL, frames come over a WebSocket instead of MJPEG.
+if (location.search.includes("ws")) {
+  const view = document.getElementById("view");
+  const socket = new WebSocket(`ws://${location.host}/ws?quality=%(quality)s`);
+  socket.binaryType = "blob";
+  socket.onmessage = (event) => {
+    const url = URL.createObjectURL(event.data);
+    view.onload = () => URL.revokeObjectURL(url);
+    view.src = url;
+  };
+}
+</script></body></html>
+"""
+
+
+class _Client:
+    """
+    One connected display. It holds at most one pending frame: a newer frame
+    replaces one the client has not sent yet, which counts as a drop.
+    """
+
+    def __init__(self, client_id, address, protocol, quality):
+        self.id = client_id
+        self.address = address
+        self.protocol = protocol
+        self.quality = quality
+        self.connected_at = time.monotonic()
+        self.sent = 0
+        self.dropped = 0
+        self.lag_last = 0.0
+        self.lag_max = 0.0
+        self.lag_total = 0.0
+        self._pending = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    def offer(self, seq, published_at, data):
+        with self._lock:
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = (seq, published_at, data)
+        self._ready.set()
+
+    def take(self, timeout=1.0):
+        """The newest frame not yet sent, or None if none arrived within timeout."""
+        if not self._ready.wait(timeout):
+            return None
+        with self._lock:
+            frame, self._pending = self._pending, None
+            self._ready.clear()
+        return frame
+
+    def sent_frame(self, published_at):
+        lag = time.monotonic() - published_at
+        self.sent += 1
+        self.lag_last = lag
+        self.lag_max = max(self.lag_max, lag)
+        self.lag_total += lag
+
+    def stats(self):
+        return {
+            "id": self.id,
+            "address": f"{self.address[0]}:{self.address[1]}",
+            "protocol": self.protocol,
+            "quality": self.quality,
+            "connected_s": round(time.monotonic() - self.connected_at, 1),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "lag_ms": {"last": round(1000 * self.lag_last, 1),
+                       "mean": round(1000 * self.lag_total / max(1, self.sent), 1),
+                       "max": round(1000 * self.lag_max, 1)},
+        }
+
+
+def _websocket_frame(data, opcode=WS_BINARY):
+    """A single unmasked WebSocket frame (server to client), binary by default."""
+    n = len(data)
+    first = 0x80 | opcode
+    if n < 126:
+        header = struct.pack("!BB", first, n)
+    elif n < 1 << 16:
+        header = struct.pack("!BBH", first, 126, n)
+    else:
+        header = struct.pack("!BBQ", first, 127, n)
+    return header + data
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # WebSocket upgrades require it
+
+    def log_message(self, format, *args):
+        pass  # one line per request would flood the console with long-lived streams
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        quality = parse_qs(url.query).get("quality", [DEFAULT_QUALITY])[0]
+        frame_server = self.server.frame_server
+        if url.path == "/":
+            self._send_body("text/html", (INDEX_PAGE % {"quality": quality}).encode())
+        elif url.path == "/stats":
+            self._send_body("application/json", json.dumps(frame_server.stats(), indent=1).encode())
+        elif url.path in ("/stream.mjpg", "/ws") and quality not in QUALITY_LEVELS:
+            self.send_error(400, f"Unknown quality {quality!r}; use one of {', '.join(QUALITY_LEVELS)}")
+        elif url.path == "/stream.mjpg":
+            self.send_response(200)
+            self.send_header("Content-Type", f"multipart/x-mixed-replace; boundary={BOUNDARY}")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            self._stream(frame_server, "mjpeg", quality, lambda data: b"".join((
+                f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(data)}\r\n\r\n".encode(),
+                data, b"\r\n")))
+        elif url.path == "/ws" and self.headers.get("Upgrade", "").lower() == "websocket":
+            key = self.headers.get("Sec-WebSocket-Key")
+            if not key:
+                self.send_error(400, "WebSocket upgrade without a Sec-WebSocket-Key header")
+                return
+            accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+            self.send_response(101)
+            self.send_header("Upgrade", "websocket")
+            self.send_header("Connection", "Upgrade")
+            self.send_header("Sec-WebSocket-Accept", accept)
+            self.end_headers()
+            self._stream(frame_server, "websocket", quality, _websocket_frame)
+        else:
+            self.send_error(404)
+
+    def _send_body(self, content_type, body):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send(self, data, cancelled=None):
+        """Writes data unless `cancelled` is set; returns whether it did."""
+        # Frames and the WebSocket reader's replies share the socket, and no
+        # frame may follow the reply to a close.
+        with self._write_lock:
+            if cancelled is not None and cancelled.is_set():
+                return False
+            self.wfile.write(data)
+            self.wfile.flush()
+        return True
+
+    def _stream(self, frame_server, protocol, quality, wrap):
+        self.connection.settimeout(SEND_TIMEOUT)
+        self.close_connection = True
+        self._write_lock = threading.Lock()
+        closing = threading.Event()
+        if protocol == "websocket":
+            threading.Thread(target=self._read_websocket, args=(closing,), daemon=True).start()
+        client = frame_server._connect(self.client_address, protocol, quality)
+        try:
+            while not frame_server.closed and not closing.is_set():
+                frame = client.take()
+                if frame is None:
+                    continue
+                _, published_at, data = frame
+                if not self._send(wrap(data), cancelled=closing):
+                    break
+                client.sent_frame(published_at)
+            if protocol == "websocket":
+                self._send(_websocket_frame(struct.pack("!H", 1001), WS_CLOSE), cancelled=closing)  # going away
+        except (OSError, socket.timeout):
+            pass  # the display went away or stalled for SEND_TIMEOUT
+        finally:
+            closing.set()
+            frame_server._disconnect(client)
+
+    def _read_websocket(self, closing):
+        """
+        Reads the client's WebSocket frames for as long as the stream runs:
+        pings are answered with pongs, a close is answered with a close and
+        ends the stream, and anything else is read and ignored.
+        """
+        sock = self.connection
+        buffer = b""
+
+        def read(n):
+            nonlocal buffer
+            while len(buffer) < n:
+                try:
+                    chunk = sock.recv(max(n - len(buffer), 4096))
+                except socket.timeout:
+                    if closing.is_set():
+                        raise
+                    continue  # the socket timeout is for writes; an idle client is fine
+                if not chunk:
+                    raise ConnectionResetError("client disconnected")
+                buffer += chunk
+            data, buffer = buffer[:n], buffer[n:]
+            return data
+
+        try:
+            while not closing.is_set():
+                first, second = read(2)
+                opcode, length = first & 0x0F, second & 0x7F
+                if length == 126:
+                    length = struct.unpack("!H", read(2))[0]
+                elif length == 127:
+                    length = struct.unpack("!Q", read(8))[0]
+                if length > WS_MAX_MESSAGE:
+                    break
+                mask = read(4) if second & 0x80 else b"\0\0\0\0"
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(read(length)))
+                if opcode == WS_CLOSE:
+                    with self._write_lock:
+                        closing.set()
+                    self._send(_websocket_frame(payload[:2], WS_CLOSE))  # echo the status code
+                elif opcode == WS_PING:
+                    self._send(_websocket_frame(payload, WS_PONG))
+        except OSError:
+            pass  # the connection is gone or the stream ended
+        finally:
+            closing.set()
+
+
+class FrameServer:
+    """
+    Streams the visuals to browsers and remote displays over HTTP.
+
+    Any render loop calls publish(frame) once per frame. That only copies the
+    frame into a buffer; a worker thread JPEG-encodes it once per quality
+    level that has viewers and hands the same bytes to every client of that
+    level. Each client is served by its own thread and holds only the newest
+    frame, so a slow client drops frames instead of slowing down the
+    renderer or the other clients.
+
+    Endpoints: / (a viewer page; add ?ws to use WebSocket), /stream.mjpg
+    (MJPEG), /ws (WebSocket, one binary JPEG message per frame) and /stats
+    (per-client lag and drops as JSON). Stream endpoints take ?quality=high|medium|low.
+
+    Args:
+      host (str): Interface to listen on; "0.0.0.0" for the local network.
+        There is no authentication: anyone who can reach the port can watch.
+      port (int): TCP port; 0 picks a free one (see self.port).
+    """
+
+    def __init__(self, host="127.0.0.1", port=8080):
+        self.closed = False
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.frame_server = self
+        self.host, self.port = self._httpd.server_address[:2]
+        self._clients = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._new_frame = threading.Condition(self._lock)
+        self._pending = None  # frame buffer written by publish()
+        self._working = None  # frame buffer being encoded
+        self._pending_time = None
+        self._seq = 0
+        self._last = None  # (seq, published_at, {quality: JPEG bytes}) of the newest frame
+        self._joined = []  # new clients waiting for the newest frame at a quality not yet encoded
+        self.published = 0
+        self.encoded = 0
+        self.encode_failures = 0
+        self.encode_seconds = 0.0
+        self._server_thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._encoder_thread = threading.Thread(target=self._encode_loop, daemon=True)
+        self._server_thread.start()
+        self._encoder_thread.start()
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/"
+
+    def _connect(self, address, protocol, quality):
+        with self._lock:
+            client = _Client(next(self._ids), address, protocol, quality)
+            self._clients[client.id] = client
+            # Show the current picture right away rather than at the next
+            # publish(), which may be a whole generation away.
+            if self._last is not None:
+                seq, published_at, encoded = self._last
+                if quality in encoded:
+                    client.offer(seq, published_at, encoded[quality])
+                else:
+                    self._joined.append(client)
+                    self._new_frame.notify()
+        return client
+
+    def _disconnect(self, client):
+        with self._lock:
+            self._clients.pop(client.id, None)
+
+    def publish(self, frame):
+        """
+        Offers a BGR uint8 frame to the viewers. Never blocks on encoding or
+        the network; a frame the encoder has not picked up yet is replaced.
+        With nobody watching the frame is kept but not encoded, so a display
+        that connects later is shown it right away.
+        """
+        with self._lock:
+            self.published += 1
+            if self._pending is None or self._pending.shape != frame.shape:
+                self._pending = np.empty_like(frame)
+            np.copyto(self._pending, frame)
+            self._pending_time = time.monotonic()
+            self._seq += 1
+            self._new_frame.notify()
+
+    def _encode_loop(self):
+        seq = 0
+        while True:
+            with self._lock:
+                while self._seq == seq and not self._joined and not self.closed:
+                    self._new_frame.wait()
+                if self.closed:
+                    return
+                if self._seq != seq:
+                    # Swap buffers so publish() can fill the other one meanwhile.
+                    self._pending, self._working = self._working, self._pending
+                    seq, published_at = self._seq, self._pending_time
+                    clients = list(self._clients.values())
+                    encoded = {}
+                else:
+                    # Only newcomers need the frame already encoded for the others.
+                    published_at, encoded = self._last[1:]
+                    clients = self._joined
+                self._joined = []
+            frame = self._working
+            start = time.perf_counter()
+            for quality in {client.quality for client in clients}:
+                if quality not in encoded:
+                    data = self._encode(frame, quality)
+                    if data is None:
+                        self.encode_failures += 1
+                        continue
+                    encoded[quality] = data
+                for client in clients:
+                    if client.quality == quality:
+                        client.offer(seq, published_at, encoded[quality])
+            with self._lock:
+                self._last = (seq, published_at, encoded)
+            if clients:
+                self.encode_seconds += time.perf_counter() - start
+                self.encoded += 1
+
+    @staticmethod
+    def _encode(frame, quality):
+        """The frame as JPEG bytes at a quality level, or None if it cannot be encoded."""
+        jpeg_quality, max_width = QUALITY_LEVELS[quality]
+        try:
+            if max_width and frame.shape[1] > max_width:
+                height = round(frame.shape[0] * max_width / frame.shape[1])
+                frame = cv2.resize(frame, (max_width, height), interpolation=cv2.INTER_AREA)
+            ok, data = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+        except cv2.error:
+            return None  # e.g. an empty frame or an unsupported dtype; must not kill the encoder
+        return data.tobytes() if ok else None
+
+    def stats(self):
+        """Frames published and encoded, mean encode time, encode failures, and every client's lag and drops."""
+        with self._lock:
+            clients = [client.stats() for client in self._clients.values()]
+        return {
+            "published": self.published,
+            "encoded": self.encoded,
+            "encode_ms": round(1000 * self.encode_seconds / max(1, self.encoded), 2),
+            "encode_failures": self.encode_failures,
+            "clients": clients,
+        }
+
+    def report(self):
+        """Prints one line per connected client."""
+        for client in self.stats()["clients"]:
+            lag = client["lag_ms"]
+            print(f"  client {client['id']} {client['address']} ({client['protocol']}, {client['quality']}): "
+                  f"{client['sent']} sent, {client['dropped']} dropped, "
+                  f"lag {lag['last']:.0f} ms (mean {lag['mean']:.0f}, max {lag['max']:.0f})")
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            self._new_frame.notify()
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._encoder_thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def test_pattern(t, width=1280, height=720):
+    """A moving colour gradient for trying the server without a render loop."""
+    x = np.linspace(0, 179, width, dtype=np.float32)
+    hue = ((x[None, :] + 60 * t + np.linspace(0, 30, height, dtype=np.float32)[:, None]) % 180).astype(np.uint8)
+    hsv = cv2.merge((hue, np.full_like(hue, 255), np.full_like(hue, 255)))
+    return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+
+
+def _read_mjpeg(port, quality, stop, delay=0.0):
+    """A localhost MJPEG client that sleeps `delay` seconds per chunk it reads."""
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        sock.sendall(f"GET /stream.mjpg?quality={quality} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 14)
+        while not stop.is_set():
+            if not sock.recv(1 << 14):
+                return
+            time.sleep(delay)
+
+
+def _read_websocket(port, quality, stop):
+    """A localhost WebSocket client that reads every message."""
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        key = base64.b64encode(b"frame-server-test").decode()
+        sock.sendall((f"GET /ws?quality={quality} HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\n"
+                      f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+        while not stop.is_set():
+            if not sock.recv(1 << 16):
+                return
+
+
+def self_test(seconds=10, fps=30):
+    """
+    Serves the test pattern on a free localhost port to three local clients
+    (a fast MJPEG reader, a deliberately slow one and a WebSocket reader),
+    then prints the publish cost seen by the renderer and every client's stats.
+
+    Raises:
+      AssertionError: if the fast reader missed a frame, the slow one dropped
+      none, or any reader was disconnected.
+    """
+    stop = threading.Event()
+    with FrameServer(port=0) as server:
+        readers = [threading.Thread(target=_read_mjpeg, args=(server.port, "high", stop), daemon=True),
+                   threading.Thread(target=_read_mjpeg, args=(server.port, "high", stop, 0.2), daemon=True),
+                   threading.Thread(target=_read_websocket, args=(server.port, "low", stop), daemon=True)]
+        # Started one at a time, so the readers above are clients 1, 2 and 3.
+        for count, reader in enumerate(readers, 1):
+            reader.start()
+            deadline = time.monotonic() + 5
+            while len(server.stats()["clients"]) < count:
+                assert time.monotonic() < deadline, f"reader {count} did not connect"
+                time.sleep(0.01)
+        publish_seconds = []
+        start = time.monotonic()
+        while time.monotonic() - start < seconds:
+            frame = test_pattern(time.monotonic() - start)
+            t0 = time.perf_counter()
+            server.publish(frame)
+            publish_seconds.append(time.perf_counter() - t0)
+            time.sleep(1.0 / fps)
+        time.sleep(0.5)  # let the fast reader take the last frame
+        stats = server.stats()
+        print(f"Published {stats['published']} frames, encoded {stats['encoded']} "
+              f"({stats['encode_ms']} ms per frame for all quality levels); "
+              f"publish() took {1000 * np.mean(publish_seconds):.2f} ms mean, "
+              f"{1000 * np.max(publish_seconds):.2f} ms max")
+        server.report()
+        stop.set()
+    clients = {client["id"]: client for client in stats["clients"]}
+    assert set(clients) == {1, 2, 3}, f"readers disconnected: {sorted({1, 2, 3} - set(clients))}"
+    fast, slow = clients[1], clients[2]
+    assert fast["sent"] == stats["published"] and fast["dropped"] == 0, (
+        f"the fast reader got {fast['sent']} of {stats['published']} frames ({fast['dropped']} dropped)")
+    assert slow["dropped"] > 0, "the slow reader dropped no frames"
+    print("Self-test passed")
+
+
+def main():
+    # Usage: python frame_server.py [PORT] [--lan]   serves a test pattern
+    #        python frame_server.py test             localhost self-test with three clients
+    if sys.argv[1:2] == ["test"]:
+        self_test()
+        return
+    args = [a for a in sys.argv[1:] if a != "--lan"]
+    host = "0.0.0.0" if "--lan" in sys.argv else "127.0.0.1"
+    with FrameServer(host, int(args[0]) if args else 8080) as server:
+        print(f"Serving a test pattern at {server.url} (Ctrl+C to stop)")
+        start = time.monotonic()
+        last_report = start
+        try:
+            while True:
+                server.publish(test_pattern(time.monotonic() - start))
+                time.sleep(1 / 30)
+                if time.monotonic() - last_report >= 5:
+                    server.report()
+                    last_report = time.monotonic()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
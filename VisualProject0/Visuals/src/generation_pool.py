@@ -0,0 +1,230 @@
+# src/generation_pool.py
+import gc
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+
+import torch
+
+from generator import generate_image
+
+_STOP = (float("inf"), float("inf"), None, None)  # sorts after every job
+
+
+def split_cores(workers, threads_per_worker=None):
+    """
+    Splits the CPUs this process may run on into one disjoint set per worker.
+
+    Returns:
+      A list of core lists, each threads_per_worker long (by default an even
+      share of the available cores).
+
+    Raises:
+      ValueError: if the workers would need more cores than are available,
+      since overlapping sets would oversubscribe them.
+    """
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+    threads = threads_per_worker or len(cores) // workers
+    if threads < 1 or workers * threads > len(cores):
+        raise ValueError(f"{workers} workers x {threads or 1} threads need more than the {len(cores)} available cores")
+    return [cores[w * threads:(w + 1) * threads] for w in range(workers)]
+
+
+def _worker(index, pipe, cores, jobs, ready, results):
+    # Split the machine instead of oversubscribing it: every worker gets its
+    # own cores and an intra-op thread pool of the same size.
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    ready.put(index)
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        job_id, prompt, kwargs = job
+        start = time.perf_counter()
+        try:
+            with torch.inference_mode():
+                image = generate_image(pipe, prompt, **kwargs)
+            results.put((job_id, image, None, time.perf_counter() - start, index))
+        except Exception:
+            results.put((job_id, None, traceback.format_exc(), time.perf_counter() - start, index))
+        ready.put(index)
+
+
+class GenerationPool:
+    """
+    Generates several images at once on a many-core CPU.
+
+    The pipeline is loaded once in this process and the workers are forked
+    from it, so they share the weights copy-on-write instead of each holding
+    a copy. Each worker is pinned to its own cores with a matching intra-op
+    thread count. Jobs wait in a priority queue here and go to whichever
+    worker becomes idle first.
+
+    The pipeline must not have run inference in this process before the
+    pool is created: forking after OpenMP has started its threads can hang.
+
+    If a worker dies (e.g. killed for running out of memory), the job it was
+    running and every job still queued fail with a RuntimeError, and the
+    pool is broken: submit() raises from then on. Jobs already running on
+    other workers still finish.
+
+    Args:
+      pipe: The pipeline (see load_diffusion_model), on the CPU.
+      workers (int): Number of worker processes.
+      threads_per_worker (int): Intra-op threads per worker; by default the
+        available cores are divided evenly. Raises ValueError if the workers
+        would need more cores than are available.
+      poll_interval (float): Seconds between checks that the workers are alive.
+    """
+
+    def __init__(self, pipe, workers=2, threads_per_worker=None, poll_interval=0.5):
+        context = mp.get_context("fork")
+        self.workers = workers
+        self.cores = split_cores(workers, threads_per_worker)
+        self.poll_interval = poll_interval
+        self._pending = queue.PriorityQueue()
+        self._futures = {}
+        self._running = {}  # worker index -> job id
+        self._lock = threading.Lock()
+        self._broken = None
+        self._ids = itertools.count()
+        self._ready = context.Queue()
+        self._results = context.Queue()
+        self._jobs = [context.Queue() for _ in range(workers)]
+
+        # Keep the collector from dirtying the pages of every object the
+        # children inherit, which would defeat copy-on-write.
+        gc.collect()
+        gc.freeze()
+        self._processes = [context.Process(target=_worker, daemon=True,
+                                           args=(i, pipe, self.cores[i], self._jobs[i], self._ready, self._results))
+                           for i in range(workers)]
+        for process in self._processes:
+            process.start()
+        gc.unfreeze()
+
+        self._closed = False
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._dispatcher.start()
+        self._collector.start()
+
+    def submit(self, prompt, priority=0, **kwargs):
+        """
+        Queues one generation.
+
+        Args:
+          prompt (str): The prompt.
+          priority (int): Lower values are generated first; equal priorities
+            keep their submission order.
+          **kwargs: Passed to generate_image; output_type defaults to "np".
+
+        Returns:
+          A concurrent.futures.Future for the image.
+        """
+        if self._closed:
+            raise RuntimeError("GenerationPool is closed")
+        kwargs.setdefault("output_type", "np")
+        job_id = next(self._ids)
+        future = Future()
+        with self._lock:
+            if self._broken:
+                raise RuntimeError(f"GenerationPool is broken: {self._broken}")
+            self._futures[job_id] = future
+            self._pending.put((priority, job_id, prompt, kwargs))
+        return future
+
+    def _fail(self, job_id, message):
+        future = self._futures.pop(job_id, None)
+        if future is not None and not future.done():
+            future.set_exception(RuntimeError(message))
+
+    def _dispatch(self):
+        while True:
+            worker = self._ready.get()
+            if worker is None:
+                return  # the pool broke
+            priority, job_id, prompt, kwargs = self._pending.get()
+            if prompt is None:
+                return
+            with self._lock:
+                if self._broken:
+                    self._fail(job_id, f"GenerationPool is broken: {self._broken}")
+                    continue
+                self._running[worker] = job_id
+            self._jobs[worker].put((job_id, prompt, kwargs))
+
+    def _check_workers(self):
+        """Fails the jobs of workers that died and breaks the pool on the first death."""
+        with self._lock:
+            for index, process in enumerate(self._processes):
+                code = process.exitcode
+                if code is None or (code == 0 and self._closed):
+                    continue
+                reason = f"worker {index} died with exit code {code}"
+                if code < 0:
+                    reason += f" (signal {-code}; SIGKILL usually means it ran out of memory)"
+                if index in self._running:
+                    self._fail(self._running.pop(index), f"Generation failed: {reason}")
+                if self._broken:
+                    continue
+                self._broken = reason
+                print(f"GenerationPool: {reason}; failing the queued jobs")
+                while True:
+                    try:
+                        job = self._pending.get_nowait()
+                    except queue.Empty:
+                        break
+                    if job[2] is not None:
+                        self._fail(job[1], f"GenerationPool is broken: {reason}")
+                # Wake the dispatcher whichever queue it is waiting on.
+                self._pending.put(_STOP)
+                self._ready.put(None)
+
+    def _collect(self):
+        while True:
+            try:
+                job_id, image, error, seconds, worker = self._results.get(timeout=self.poll_interval)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            if job_id is None:
+                return
+            with self._lock:
+                self._running.pop(worker, None)
+                future = self._futures.pop(job_id, None)
+            if future is None or future.done():
+                continue  # already failed when its worker was found dead
+            if error:
+                future.set_exception(RuntimeError(f"Generation failed in worker {worker}:\n{error}"))
+            else:
+                future.seconds, future.worker = seconds, worker
+                future.set_result(image)
+            self._check_workers()
+
+    def close(self):
+        """Finishes the queued jobs, then stops the workers."""
+        if self._closed:
+            return
+        self._closed = True
+        self._pending.put(_STOP)
+        self._dispatcher.join()
+        for jobs in self._jobs:
+            jobs.put(None)
+        for process in self._processes:
+            process.join()
+        self._results.put((None, None, None, None, None))
+        self._collector.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,11 +1,419 @@
 # src/generator.py
+import collections
+import contextlib
+import gc
+import json
+import os
+import platform
+import tempfile
+import threading
+import time
+
+import cv2
 from diffusers import StableDiffusionPipeline
+import numpy as np
 import torch
 
 
 import torch
 
-def load_diffusion_model(model_name="CompVis/stable-diffusion-v1-4", device=None):
+# Defaults for the CPU-tuned loading mode (see optimize_for_cpu).
+CPU_PROFILE = {
+    "threads": None,
+    "channels_last": True,
+    "attention": "sdpa",
+    "bfloat16": False,
+    "compile": False,
+    "compile_cache_dir": None,
+}
+
+
+def bfloat16_supported():
+    """Whether this CPU has native bfloat16 kernels (AVX512-BF16 / AMX) in oneDNN."""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def optimize_for_cpu(pipe, threads=None, channels_last=True, attention="sdpa", bfloat16=False,
+                     compile=False, compile_cache_dir=None, warmup=True):
+    """
+    Tunes a float32 pipeline for CPU-only inference, in place.
+
+    Args:
+      pipe: The Stable Diffusion pipeline instance (already on the CPU).
+      threads (int): Intra-op threads for torch; None keeps torch's default (all cores).
+      channels_last (bool): Store UNet and VAE convolution weights as NHWC, which
+        oneDNN convolutions run faster on.
+      attention (str): "sdpa" for torch's fused scaled_dot_product_attention,
+        "sliced" to compute attention in slices (lower peak memory), or
+        "default" for the pipeline's own choice.
+      bfloat16 (bool): Run the denoising loop under bfloat16 autocast; ignored
+        when the CPU lacks native bfloat16 support.
+      compile (bool): Compile the UNet with torch.compile.
+      compile_cache_dir (str): Directory where compiled kernels are persisted,
+        so later processes reuse them instead of recompiling.
+      warmup (bool): With compile, run a one-step generation now so compilation
+        happens at load time rather than on the first image.
+
+    Returns:
+      The same pipeline.
+    """
+    if threads:
+        torch.set_num_threads(threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass  # can only be set before the first parallel op
+
+    if channels_last:
+        pipe.unet.to(memory_format=torch.channels_last)
+        pipe.vae.to(memory_format=torch.channels_last)
+
+    if attention == "sliced":
+        pipe.enable_attention_slicing()
+    elif attention == "sdpa":
+        from diffusers.models.attention_processor import AttnProcessor2_0
+        pipe.unet.set_attn_processor(AttnProcessor2_0())
+        pipe.vae.set_attn_processor(AttnProcessor2_0())
+
+    pipe.cpu_autocast_dtype = None
+    if bfloat16:
+        if bfloat16_supported():
+            pipe.cpu_autocast_dtype = torch.bfloat16
+        else:
+            print("bfloat16 requested but not supported natively by this CPU; staying in float32.")
+
+    if compile:
+        if compile_cache_dir:
+            # Inductor persists compiled graphs here and reloads them on the next start.
+            os.makedirs(compile_cache_dir, exist_ok=True)
+            os.environ["TORCHINDUCTOR_CACHE_DIR"] = compile_cache_dir
+            import torch._inductor.config as inductor_config
+            inductor_config.fx_graph_cache = True
+        pipe.unet = torch.compile(pipe.unet)
+        if warmup:
+            generate_image(pipe, "warmup", num_inference_steps=1)
+    return pipe
+
+
+# Where quantized components are persisted, one subdirectory per model.
+QUANTIZED_CACHE_DIR = "quantized_models"
+QUANTIZED_COMPONENTS = ("text_encoder", "unet")
+
+
+def quantize_pipeline(pipe):
+    """
+    Applies dynamic int8 quantization to the Linear layers of the text encoder
+    and UNet: weights are stored as int8 and activations are quantized on the
+    fly, which speeds up the matmuls that dominate CPU inference. Convolutions
+    and the VAE stay in float32. CPU only.
+    """
+    from torch.ao.quantization import quantize_dynamic
+    for name in QUANTIZED_COMPONENTS:
+        setattr(pipe, name, quantize_dynamic(getattr(pipe, name), {torch.nn.Linear}, dtype=torch.qint8))
+    return pipe
+
+
+def _empty_quantized_linears(module):
+    """
+    Swaps every torch.nn.Linear below module for an uninitialised dynamic int8
+    Linear of the same shape, i.e. the structure quantize_dynamic would produce
+    but without computing any quantization; load_state_dict then fills it in.
+    """
+    from torch.ao.nn.quantized.dynamic import Linear as DynamicLinear
+    for name, child in module.named_children():
+        if type(child) is torch.nn.Linear:
+            setattr(module, name, DynamicLinear(child.in_features, child.out_features,
+                                                bias_=child.bias is not None, dtype=torch.qint8))
+        else:
+            _empty_quantized_linears(child)
+    return module
+
+
+def _quantized_cache_path(cache_dir, model_name):
+    return os.path.join(cache_dir, model_name.replace("/", "--"))
+
+
+def save_quantized_components(pipe, cache_dir, model_name):
+    """
+    Persists the state dicts of the quantized text encoder and UNet. Only
+    tensors are saved, never pickled modules, so loading executes no code.
+    """
+    path = _quantized_cache_path(cache_dir, model_name)
+    os.makedirs(path, exist_ok=True)
+    for name in QUANTIZED_COMPONENTS:
+        torch.save(getattr(pipe, name).state_dict(), os.path.join(path, f"{name}.pt"))
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump({"model_name": model_name, "torch": torch.__version__}, f)
+
+
+def load_quantized_components(pipe, cache_dir, model_name):
+    """
+    Fills the text encoder and UNet of a freshly loaded float32 pipeline from a
+    persisted artefact: their Linear layers are swapped for empty int8 ones and
+    loaded with the saved weights, so nothing is quantized again.
+
+    Returns:
+      True if the artefact was applied, False (leaving pipe untouched) if
+      there is none for this model and torch version.
+    """
+    path = _quantized_cache_path(cache_dir, model_name)
+    try:
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if meta.get("model_name") != model_name or meta.get("torch") != torch.__version__:
+        return False
+    states = {name: torch.load(os.path.join(path, f"{name}.pt"), weights_only=True)
+              for name in QUANTIZED_COMPONENTS}
+    for name, state in states.items():
+        _empty_quantized_linears(getattr(pipe, name)).load_state_dict(state)
+    return True
+
+
+# Rough float32 weight sizes of the Stable Diffusion 1.x components in MB,
+# used when the model files are not on disk to measure.
+COMPONENT_MB = {"text_encoder": 470, "unet": 3280, "vae": 320}
+# Working memory on top of the resident weights for a 512x512 render
+# (activations, the torch runtime, the interpreter), per memory strategy.
+OVERHEAD_MB = {"full": 2200, "tiled": 1100, "sequential": 1100}
+# Strategies from fastest to leanest (see load_diffusion_model).
+MEMORY_STRATEGIES = ("full", "tiled", "sequential")
+# Edge length in pixels above which the VAE decodes in overlapping tiles.
+VAE_TILE_SIZE = 256
+
+
+def _component_sizes_mb(model_name):
+    """Float32 weight size of each component, from the local files if available."""
+    try:
+        if os.path.isdir(model_name):
+            root = model_name
+        else:
+            from huggingface_hub import snapshot_download
+            root = snapshot_download(model_name, local_files_only=True)
+    except Exception:
+        return dict(COMPONENT_MB)  # not downloaded yet (or no hub client)
+    sizes = {}
+    for name, default in COMPONENT_MB.items():
+        folder = os.path.join(root, name)
+        files = [os.path.join(folder, f) for f in (os.listdir(folder) if os.path.isdir(folder) else [])
+                 if f.endswith((".safetensors", ".bin")) and ".fp16." not in f]
+        sizes[name] = max((os.path.getsize(f) for f in files), default=default * 2 ** 20) / 2 ** 20
+    return sizes
+
+
+def estimate_memory_mb(model_name):
+    """Estimated peak RSS in MB of one generation with each memory strategy."""
+    sizes = _component_sizes_mb(model_name)
+    return {
+        "full": sum(sizes.values()) + OVERHEAD_MB["full"],
+        "tiled": sum(sizes.values()) + OVERHEAD_MB["tiled"],
+        "sequential": max(sizes.values()) + OVERHEAD_MB["sequential"],
+    }
+
+
+def choose_memory_strategy(budget_mb, model_name):
+    """The fastest strategy whose estimated peak fits in budget_mb ("sequential" if none does)."""
+    estimates = estimate_memory_mb(model_name)
+    for strategy in MEMORY_STRATEGIES:
+        if estimates[strategy] <= budget_mb:
+            return strategy
+    print(f"No memory strategy is estimated to fit in {budget_mb} MB "
+          f"(sequential needs about {estimates['sequential']:.0f} MB); using sequential anyway.")
+    return "sequential"
+
+
+def _rss_mb():
+    """
+    Current resident memory of this process in MB, or None where it cannot be
+    read (no /proc). getrusage's ru_maxrss is not a substitute: it is the
+    peak over the whole process lifetime, so it never drops between measurements.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return None
+
+
+class PeakMemory:
+    """
+    Measures the peak resident memory of this process over a with-block, in MB.
+
+    On Linux the kernel's high-water mark (VmHWM) is reset on entry and read
+    on exit, which catches short spikes exactly; where that is not possible
+    but /proc is, RSS is sampled on a background thread every `interval`
+    seconds. Without /proc (e.g. macOS) peak_mb is None: unavailable.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.peak_mb = _rss_mb()
+        if self.peak_mb is None:
+            return self
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")  # resets VmHWM to the current RSS
+        except OSError:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, _rss_mb())
+
+    def __exit__(self, *exc):
+        if self.peak_mb is None:
+            return
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak_mb = max(self.peak_mb, _rss_mb())
+            return
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    self.peak_mb = int(line.split()[1]) / 2 ** 10
+
+
+def _encode_prompt(tokenizer, text_encoder, prompt, guidance_scale, device="cpu"):
+    """Text embeddings for the prompt, preceded by the empty prompt's when guidance is on."""
+    prompts = ["", prompt] if guidance_scale > 1 else [prompt]
+    tokens = tokenizer(prompts, padding="max_length", max_length=tokenizer.model_max_length,
+                       truncation=True, return_tensors="pt")
+    return text_encoder(tokens.input_ids.to(device))[0]
+
+
+def _tile_vae(vae):
+    vae.enable_tiling()
+    vae.tile_sample_min_size = VAE_TILE_SIZE
+    vae.tile_latent_min_size = VAE_TILE_SIZE // 8
+
+
+class LowMemoryPipeline:
+    """
+    Stable Diffusion for machines that cannot hold the whole pipeline in RAM.
+
+    Components are loaded lazily, one at a time, straight from the model
+    files (memory-mapped safetensors), and released as soon as their stage
+    is done: the text encoder for the prompt, then the UNet for the denoising
+    loop, then the VAE, which decodes in tiles. Only the active module is
+    ever resident, at the cost of reading each one from disk (usually the
+    page cache) on every generation.
+
+    Called like StableDiffusionPipeline for the arguments generate_image uses;
+    output_type "np", "pil" and "latent" are supported.
+    """
+
+    def __init__(self, model_name, dtype=torch.float32):
+        from diffusers import AutoencoderKL, UNet2DConditionModel
+        from transformers import CLIPTokenizer
+        import diffusers
+
+        self.model_name = model_name
+        self.dtype = dtype
+        self.tokenizer = CLIPTokenizer.from_pretrained(model_name, subfolder="tokenizer")
+        config = diffusers.DDIMScheduler.load_config(model_name, subfolder="scheduler")
+        self.scheduler = getattr(diffusers, config["_class_name"]).from_config(config)
+        self.vae_config = AutoencoderKL.load_config(model_name, subfolder="vae")
+        self.unet_config = UNet2DConditionModel.load_config(model_name, subfolder="unet")
+        self.vae_scale_factor = 2 ** (len(self.vae_config["block_out_channels"]) - 1)
+
+    @contextlib.contextmanager
+    def component(self, name):
+        """Loads one component for the duration of a with-block, then frees it."""
+        from diffusers import AutoencoderKL, UNet2DConditionModel
+        from transformers import CLIPTextModel
+
+        cls = {"text_encoder": CLIPTextModel, "unet": UNet2DConditionModel, "vae": AutoencoderKL}[name]
+        module = cls.from_pretrained(self.model_name, subfolder=name, torch_dtype=self.dtype,
+                                     low_cpu_mem_usage=True).eval()
+        try:
+            yield module
+        finally:
+            del module
+            gc.collect()
+
+    def encode_prompt(self, prompt, guidance_scale):
+        with self.component("text_encoder") as text_encoder, torch.no_grad():
+            return _encode_prompt(self.tokenizer, text_encoder, prompt, guidance_scale)
+
+    def denoise(self, embeddings, num_inference_steps, guidance_scale, height, width, generator=None):
+        guided = guidance_scale > 1
+        with self.component("unet") as unet, torch.no_grad():
+            unet.set_attention_slice("auto")
+            shape = (1, unet.config.in_channels, height // self.vae_scale_factor, width // self.vae_scale_factor)
+            latents = torch.randn(shape, generator=generator, dtype=self.dtype) * self.scheduler.init_noise_sigma
+            self.scheduler.set_timesteps(num_inference_steps)
+            for t in self.scheduler.timesteps:
+                model_input = torch.cat([latents] * 2) if guided else latents
+                model_input = self.scheduler.scale_model_input(model_input, t)
+                noise = unet(model_input, t, encoder_hidden_states=embeddings).sample
+                if guided:
+                    uncond, text = noise.chunk(2)
+                    noise = uncond + guidance_scale * (text - uncond)
+                latents = self.scheduler.step(noise, t, latents).prev_sample
+        return latents
+
+    def decode(self, latents):
+        """Decodes latents with a tiled VAE into H x W x 3 float images in [0, 1]."""
+        with self.component("vae") as vae, torch.no_grad():
+            _tile_vae(vae)
+            image = vae.decode(latents / vae.config.scaling_factor).sample
+        return (image / 2 + 0.5).clamp(0, 1).permute(0, 2, 3, 1).float().numpy()
+
+    def __call__(self, prompt, num_inference_steps=50, guidance_scale=7.5, height=None, width=None,
+                 output_type="pil", generator=None):
+        from diffusers.pipelines.stable_diffusion import StableDiffusionPipelineOutput
+
+        default = self.unet_config["sample_size"] * self.vae_scale_factor
+        embeddings = self.encode_prompt(prompt, guidance_scale)
+        latents = self.denoise(embeddings, num_inference_steps, guidance_scale,
+                               height or default, width or default, generator)
+        if output_type == "latent":
+            return StableDiffusionPipelineOutput(images=latents, nsfw_content_detected=None)
+        images = self.decode(latents)
+        if output_type == "pil":
+            from PIL import Image
+            images = [Image.fromarray((image * 255).round().astype(np.uint8)) for image in images]
+        return StableDiffusionPipelineOutput(images=images, nsfw_content_detected=None)
+
+
+def load_diffusion_model(model_name="CompVis/stable-diffusion-v1-4", device=None, cpu_profile=None,
+                         quantize=False, quantized_cache_dir=QUANTIZED_CACHE_DIR, memory_budget_mb=None,
+                         memory_strategy=None):
+    """
+    Loads the Stable Diffusion pipeline onto the best available device.
+
+    Args:
+      model_name (str): Hugging Face model id or local path.
+      device (str): "mps", "cuda" or "cpu"; picked automatically if None.
+      cpu_profile (dict or bool): On the CPU, tune the pipeline with
+        optimize_for_cpu. True uses CPU_PROFILE; a dict overrides its entries.
+      quantize (bool): On the CPU, use dynamic int8 quantization for the text
+        encoder and UNet (see quantize_pipeline).
+      quantized_cache_dir (str): Where the quantized components are persisted
+        and reloaded from; None quantizes on every load.
+      memory_budget_mb (float): On the CPU, the peak RSS a generation may use.
+        The fastest strategy estimated to fit is picked (see memory_strategy),
+        and each generation prints its measured peak.
+      memory_strategy (str): Force a strategy instead: "full" keeps everything
+        resident, "tiled" adds sliced attention and a tiled VAE decode, and
+        "sequential" returns a LowMemoryPipeline that loads one component at a
+        time (CPU only; cpu_profile and quantize do not apply to it).
+
+    Raises:
+      ValueError: If the "sequential" strategy is requested for "cuda" or "mps".
+    """
     # Prioritize Apple MPS if available, then CUDA, then default to CPU.
     if device is None:
         if torch.backends.mps.is_available():
@@ -14,16 +422,256 @@ def load_diffusion_model(model_name="CompVis/stable-diffusion-v1-4", device=None
             device = "cuda"
         else:
             device = "cpu"
+    quantize = quantize and device == "cpu"
+    if device == "cpu" and memory_budget_mb and not memory_strategy:
+        memory_strategy = choose_memory_strategy(memory_budget_mb, model_name)
+        print(f"Memory budget {memory_budget_mb} MB: using the {memory_strategy!r} strategy.")
+    if memory_strategy == "sequential":
+        if device != "cpu":
+            raise ValueError(f"The 'sequential' memory strategy runs on the CPU only, not on {device!r}; "
+                             f"use 'tiled' or load with device='cpu'.")
+        pipe = LowMemoryPipeline(model_name)
+        pipe.memory_strategy, pipe.memory_budget_mb = memory_strategy, memory_budget_mb
+        return pipe
     pipe = StableDiffusionPipeline.from_pretrained(
         model_name,
-        torch_dtype=torch.float16 if device in ["cuda", "mps"] else torch.float32
+        torch_dtype=torch.float16 if device in ["cuda", "mps"] else torch.float32,
     )
     pipe = pipe.to(device)
+    if quantize:
+        cached = quantized_cache_dir and load_quantized_components(pipe, quantized_cache_dir, model_name)
+        if not cached:
+            quantize_pipeline(pipe)
+            if quantized_cache_dir:
+                save_quantized_components(pipe, quantized_cache_dir, model_name)
+    if device == "cpu" and cpu_profile:
+        options = dict(CPU_PROFILE)
+        if isinstance(cpu_profile, dict):
+            options.update(cpu_profile)
+        optimize_for_cpu(pipe, **options)
+    if memory_strategy == "tiled":
+        pipe.enable_attention_slicing()
+        _tile_vae(pipe.vae)
+    pipe.memory_strategy, pipe.memory_budget_mb = memory_strategy, memory_budget_mb
     return pipe
 
 
+def _autocast(pipe):
+    """bfloat16 autocast if the pipeline was tuned for it, otherwise a no-op context."""
+    dtype = getattr(pipe, "cpu_autocast_dtype", None)
+    if dtype is None:
+        return contextlib.nullcontext()
+    return torch.autocast("cpu", dtype=dtype)
+
+
+# Where deadline mode keeps the step costs it has learned on this machine.
+STEP_COSTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "step_costs.json")
+
+
+class DeadlineModel:
+    """
+    What deadline mode has learned about this machine, and how well it did.
+
+    Seconds per denoising step, per text encoding and per VAE decode are kept
+    as moving averages for each machine, model, device, resolution and
+    whether classifier-free guidance doubles the batch, and persisted
+    to `filename`, so a render node plans its first image of the day from its
+    own past measurements. The report covers the most recent `history` jobs.
+
+    Args:
+      filename (str): JSON file of learned costs; None keeps them in memory.
+      smoothing (float): Weight of each new measurement in the moving averages.
+      history (int): Number of recent jobs kept for report().
+      save_interval (float): Minimum seconds between writes of `filename`.
+    """
+
+    def __init__(self, filename=STEP_COSTS_FILE, smoothing=0.2, history=1000, save_interval=30.0):
+        self.filename = filename
+        self.smoothing = smoothing
+        self.save_interval = save_interval
+        self.costs = {}
+        self.results = collections.deque(maxlen=history)  # (deadline, elapsed, steps, max_steps)
+        self._saved_at = None
+        if filename and os.path.exists(filename):
+            try:
+                with open(filename) as f:
+                    self.costs = json.load(f)
+            except (OSError, ValueError):
+                pass  # unreadable: start learning again
+
+    @staticmethod
+    def key(device, size, model_id, guided):
+        return f"{platform.node()}|{model_id}|{device}|{size[0]}x{size[1]}|{'cfg' if guided else 'no-cfg'}"
 
-def generate_image(pipe, prompt, num_inference_steps=50, guidance_scale=7.5):
+    def cost(self, key, name):
+        """Learned seconds for "step", "encode" or "decode", or None if never measured."""
+        return self.costs.get(key, {}).get(name)
+
+    def learn(self, key, name, seconds):
+        costs = self.costs.setdefault(key, {})
+        previous = costs.get(name)
+        costs[name] = seconds if previous is None else previous + self.smoothing * (seconds - previous)
+
+    def save(self, force=False):
+        """
+        Atomically rewrites `filename`, at most once every save_interval
+        seconds unless force is set.
+        """
+        if not self.filename:
+            return
+        now = time.monotonic()
+        if not force and self._saved_at is not None and now - self._saved_at < self.save_interval:
+            return
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".tmp", delete=False) as f:
+            json.dump(self.costs, f, indent=1)
+        try:
+            os.replace(f.name, self.filename)
+        except OSError:
+            os.remove(f.name)
+            raise
+        self._saved_at = now
+
+    def record(self, deadline, elapsed, steps, max_steps):
+        self.results.append((deadline, elapsed, steps, max_steps))
+
+    def report(self):
+        """Deadline hit rate and the step counts achieved so far."""
+        if not self.results:
+            return {"jobs": 0, "hits": 0, "hit_rate": 0.0}
+        deadline, elapsed, steps, max_steps = (np.array(column, dtype=float) for column in zip(*self.results))
+        hits = elapsed <= deadline
+        return {
+            "jobs": len(self.results),
+            "hits": int(hits.sum()),
+            "hit_rate": float(hits.mean()),
+            "mean_lateness": float(np.mean(np.maximum(elapsed - deadline, 0))),
+            "steps_mean": float(steps.mean()),
+            "steps_min": int(steps.min()),
+            "steps_max": int(steps.max()),
+            "reduced": int((steps < max_steps).sum()),
+        }
+
+
+def _synchronize(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    elif device.type == "mps":
+        torch.mps.synchronize()
+
+
+def _generate_with_deadline(pipe, prompt, deadline_at, max_steps, guidance_scale, output_type, size, model,
+                            min_steps=1):
+    """
+    Runs the denoising loop against a deadline (a time.monotonic() time).
+
+    Instead of a fixed schedule, the step budget is re-planned after every
+    step from the time actually left, the measured step cost and the
+    expected decode time, and the next timestep is spaced to fit the steps
+    that remain (deterministic DDIM updates allow any spacing). When no
+    time is left, the run stops and decodes its current estimate of the
+    clean latents rather than the noisy ones.
+
+    Returns:
+      (image, steps): the image as pipe(...).images[0] would return it, and
+      the number of steps actually run.
+    """
+    device = pipe.device
+    scale = pipe.vae_scale_factor
+    width, height = size or (pipe.unet.config.sample_size * scale,) * 2
+    guided = guidance_scale > 1
+    key = model.key(device.type, (width, height), getattr(pipe, "name_or_path", None) or "unknown", guided)
+
+    with torch.no_grad():
+        start = time.monotonic()
+        embeddings = _encode_prompt(pipe.tokenizer, pipe.text_encoder, prompt, guidance_scale, device)
+        _synchronize(device)
+        model.learn(key, "encode", time.monotonic() - start)
+
+        alphas = pipe.scheduler.alphas_cumprod.to(device)
+        shape = (1, pipe.unet.config.in_channels, height // scale, width // scale)
+        latents = torch.randn(shape, dtype=embeddings.dtype).to(device)
+        t = pipe.scheduler.config.num_train_timesteps - 1
+        steps = 0
+        while True:
+            start = time.monotonic()
+            model_input = torch.cat([latents] * 2) if guided else latents
+            noise = pipe.unet(model_input, t, encoder_hidden_states=embeddings).sample
+            if guided:
+                uncond, text = noise.chunk(2)
+                noise = uncond + guidance_scale * (text - uncond)
+            alpha = alphas[t]
+            clean = (latents - (1 - alpha).sqrt() * noise) / alpha.sqrt()
+            _synchronize(device)
+            steps += 1
+            model.learn(key, "step", time.monotonic() - start)
+
+            # Re-plan: how many more steps fit before the decode has to start?
+            per_step = model.cost(key, "step")
+            decode = model.cost(key, "decode") or 2 * per_step
+            affordable = int((deadline_at - time.monotonic() - decode) // per_step)
+            remaining = min(max_steps - steps, max(affordable, min_steps - steps, 0))
+            if remaining <= 0 or t == 0:
+                latents = clean.to(embeddings.dtype)
+                break
+            next_t = min(t - 1, round(t * remaining / (remaining + 1)))
+            next_alpha = alphas[next_t]
+            latents = (next_alpha.sqrt() * clean + (1 - next_alpha).sqrt() * noise).to(embeddings.dtype)
+            t = next_t
+
+        if output_type == "latent":
+            return latents[0], steps
+        start = time.monotonic()
+        image = pipe.vae.decode(latents / pipe.vae.config.scaling_factor, return_dict=False)[0]
+        _synchronize(device)
+        model.learn(key, "decode", time.monotonic() - start)
+    return pipe.image_processor.postprocess(image, output_type=output_type)[0], steps
+
+
+# Interpolation and unsharp-mask strength for each upscale quality level.
+UPSCALE_METHODS = {
+    "fast": (cv2.INTER_LINEAR, 0.0),
+    "balanced": (cv2.INTER_CUBIC, 0.5),
+    "best": (cv2.INTER_LANCZOS4, 0.8),
+}
+
+
+def upscale_image(image, size, method="balanced"):
+    """
+    Upscales an H x W x 3 uint8 image on the CPU.
+
+    The interpolation is followed by an unsharp mask so edges stay crisp
+    after enlarging a low-resolution render; "fast" skips the sharpening.
+
+    Args:
+      image (np.ndarray): The image to upscale.
+      size (tuple): Output (width, height).
+      method (str): "fast", "balanced" or "best".
+    """
+    interpolation, amount = UPSCALE_METHODS[method]
+    upscaled = cv2.resize(image, size, interpolation=interpolation)
+    if amount:
+        blurred = cv2.GaussianBlur(upscaled, (0, 0), sigmaX=1.0)
+        upscaled = cv2.addWeighted(upscaled, 1 + amount, blurred, -amount, 0)
+    return upscaled
+
+
+def _upscale_latents(pipe, latents, size):
+    """Resizes the latents to the output size and decodes them there; the UNet never runs at full size."""
+    width, height = size
+    scale = pipe.vae_scale_factor
+    latents = torch.nn.functional.interpolate(latents, size=(height // scale, width // scale),
+                                              mode="bicubic", align_corners=False)
+    if isinstance(pipe, LowMemoryPipeline):
+        return (pipe.decode(latents)[0] * 255).round().astype(np.uint8)
+    with torch.no_grad():
+        image = pipe.vae.decode(latents / pipe.vae.config.scaling_factor, return_dict=False)[0]
+    image = pipe.image_processor.postprocess(image, output_type="np")[0]
+    return (image * 255).round().astype(np.uint8)
+
+
+def generate_image(pipe, prompt, num_inference_steps=50, guidance_scale=7.5, output_type="pil",
+                   size=None, upscale_to=None, upscale_method="balanced", deadline=None):
     """
     Generates an image given a prompt using the provided diffusion pipeline.
 
@@ -32,9 +680,71 @@ def generate_image(pipe, prompt, num_inference_steps=50, guidance_scale=7.5):
       prompt (str): The textual prompt to guide image generation.
       num_inference_steps (int): How many denoising steps to use.
       guidance_scale (float): Controls the adherence to the prompt.
+      output_type (str): "pil" for a PIL.Image, "np" for an RGB uint8 NumPy
+        array straight from the pipeline, skipping PIL entirely, or "latent"
+        for the undecoded latents (not combined with upscale_to).
+      size (int or tuple): Render resolution, e.g. 256 or (384, 256); must be a
+        multiple of 8. Cost grows roughly with the pixel count, so a small
+        render plus upscaling is much faster than the model's native size.
+      upscale_to (tuple): Output (width, height) to upscale the render to.
+      upscale_method (str): "fast", "balanced" or "best" for a cv2 resize
+        (see upscale_image), or "latent" to resize the latents and let the VAE
+        decode at the output size.
+      deadline (float): Seconds this call may take. num_inference_steps becomes
+        the most steps allowed; fewer are run, or the run stops early, to
+        finish in time (see _generate_with_deadline). Step costs are learned
+        in pipe.deadline_model, whose report() gives the hit rate and step
+        counts; they are written to disk at most every save_interval seconds,
+        so call pipe.deadline_model.save(force=True) before exiting to keep
+        the latest. Not supported for a LowMemoryPipeline (raises ValueError).
 
     Returns:
-      A PIL.Image object of the generated image.
+      A PIL.Image object (or an H x W x 3 uint8 array) of the generated image.
     """
-    image = pipe(prompt, num_inference_steps=num_inference_steps, guidance_scale=guidance_scale).images[0]
+    if deadline is not None and isinstance(pipe, LowMemoryPipeline):
+        raise ValueError("deadline mode is not supported for a LowMemoryPipeline (memory_strategy='sequential')")
+    if output_type == "latent" and upscale_to is not None:
+        raise ValueError("upscale_to needs a decoded output_type ('pil' or 'np'), not 'latent'")
+    started = time.monotonic()
+    if isinstance(size, int):
+        size = (size, size)
+    render = {} if size is None else {"width": size[0], "height": size[1]}
+    pipe_output = output_type
+    latent_upscale = upscale_to is not None and upscale_method == "latent"
+    if upscale_to is not None:
+        pipe_output = "latent" if latent_upscale else "np"
+
+    # Memory-constrained pipelines report the peak RSS of every generation.
+    measure = PeakMemory() if getattr(pipe, "memory_strategy", None) else contextlib.nullcontext()
+    with _autocast(pipe), measure as memory:
+        if deadline is not None:
+            if getattr(pipe, "deadline_model", None) is None:
+                pipe.deadline_model = DeadlineModel()
+            image, steps = _generate_with_deadline(pipe, prompt, started + deadline, num_inference_steps,
+                                                   guidance_scale, pipe_output, size, pipe.deadline_model)
+        else:
+            image = pipe(prompt, num_inference_steps=num_inference_steps, guidance_scale=guidance_scale,
+                         output_type=pipe_output, **render).images[0]
+        if latent_upscale:
+            image = _upscale_latents(pipe, image.unsqueeze(0), upscale_to)
+    if memory is not None:
+        pipe.last_peak_mb = memory.peak_mb
+        budget = f" of {pipe.memory_budget_mb} MB budget" if pipe.memory_budget_mb else ""
+        peak = "unavailable" if memory.peak_mb is None else f"{memory.peak_mb:.0f} MB"
+        print(f"Generation peak RSS: {peak}{budget} ({pipe.memory_strategy})")
+    if pipe_output == "np":
+        image = (image * 255).round().astype(np.uint8)
+    if upscale_to is not None:
+        if upscale_method != "latent" and image.shape[1::-1] != tuple(upscale_to):
+            image = upscale_image(image, tuple(upscale_to), upscale_method)
+        if output_type == "pil":
+            from PIL import Image
+            image = Image.fromarray(image)
+
+    if deadline is not None:
+        elapsed = time.monotonic() - started
+        pipe.deadline_model.record(deadline, elapsed, steps, num_inference_steps)
+        pipe.deadline_model.save()
+        print(f"Deadline {deadline:.1f} s: {steps}/{num_inference_steps} steps in {elapsed:.2f} s "
+              f"({'hit' if elapsed <= deadline else 'missed'})")
     return image
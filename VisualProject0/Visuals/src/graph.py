@@ -0,0 +1,336 @@
+# src/graph.py
+import sys
+import time
+
+import numpy as np
+import librosa
+
+NUM_BANDS = 8
+# Seconds of audio behind each kind of analysis in the example graphs.
+HOP_SECONDS = 0.5
+FEATURE_WINDOW = 5
+TEMPO_WINDOW = 10
+# Seconds between prompts (and images) in the example graphs.
+GENERATION_INTERVAL = 10.0
+
+
+class Node:
+    """
+    One declared step of a Graph.
+
+    Args:
+      name (str): Unique name; other nodes refer to it in their inputs.
+      fn: Called with one keyword argument per input; its return value is the
+        node's value. Sources may have no fn and get their value from Graph.step().
+      inputs (dict): Keyword argument name -> name of the node that supplies it.
+      rate (float): Seconds between evaluations; until then the previous value
+        is reused without evaluating the inputs. None evaluates on every hop
+        the node is needed.
+      sink (bool): Sinks are the consumers: only they, and what they depend
+        on, are ever evaluated.
+    """
+
+    def __init__(self, name, fn=None, inputs=None, rate=None, sink=False):
+        self.name = name
+        self.fn = fn
+        self.inputs = inputs or {}
+        self.rate = rate
+        self.sink = sink
+        self.value = None
+        self.hop = None  # hop of the last evaluation
+        self.evaluated_at = None  # time of the last evaluation
+        self.evaluations = 0
+        self.seconds = 0.0
+
+
+class Graph:
+    """
+    A declarative, demand-driven processing graph.
+
+    Sources, features, mappers and sinks are declared as nodes wired up by
+    name. Each step() is one hop: the sinks pull their inputs, recursively,
+    so only nodes some sink needs are evaluated, each at most once per hop
+    (shared intermediates like the STFT are computed once and reused), and
+    nodes with a rate only when they are due.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self._hop = 0
+        self._now = None
+
+    def add(self, name, fn, rate=None, sink=False, **inputs):
+        """Declares a node; inputs map fn's keyword arguments to node names."""
+        if name in self.nodes:
+            raise ValueError(f"Node {name!r} is already declared")
+        self.nodes[name] = Node(name, fn, inputs, rate, sink)
+        return name
+
+    def source(self, name, fn=None, rate=None):
+        """Declares a source: fn() is pulled on demand, or the value is passed to step()."""
+        return self.add(name, fn, rate)
+
+    def sink(self, name, fn, rate=None, **inputs):
+        """Declares a consumer (effects, generator, display...)."""
+        return self.add(name, fn, rate, sink=True, **inputs)
+
+    def plan(self):
+        """
+        The nodes the sinks depend on, in evaluation order.
+
+        Raises:
+          ValueError: If an input names an undeclared node or the graph has a cycle.
+        """
+        order, state = [], {}
+
+        def visit(name, path):
+            if name not in self.nodes:
+                raise ValueError(f"{path[-1]!r} reads undeclared node {name!r}")
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError("Cycle in graph: " + " -> ".join(path + [name]))
+            state[name] = "visiting"
+            for upstream in self.nodes[name].inputs.values():
+                visit(upstream, path + [name])
+            state[name] = "done"
+            order.append(name)
+
+        for node in self.nodes.values():
+            if node.sink:
+                visit(node.name, [])
+        return order
+
+    def describe(self):
+        """Prints which nodes will run, with their rates, and which are never needed."""
+        order = self.plan()
+        for name in order:
+            node = self.nodes[name]
+            rate = f"every {node.rate:g} s" if node.rate else "every hop"
+            inputs = ", ".join(node.inputs.values()) or "-"
+            print(f"  {'sink' if node.sink else 'node':>4} {name:<28} {rate:<14} <- {inputs}")
+        unused = [name for name in self.nodes if name not in order]
+        if unused:
+            print("  not needed:", ", ".join(unused))
+
+    def pull(self, name):
+        """The current value of a node, evaluating it (and its inputs) if needed this hop."""
+        node = self.nodes[name]
+        if node.hop == self._hop:
+            return node.value
+        if node.fn is None:
+            return node.value
+        if node.rate and node.evaluated_at is not None and self._now - node.evaluated_at < node.rate:
+            return node.value  # not due: the inputs are not even evaluated
+        args = {arg: self.pull(upstream) for arg, upstream in node.inputs.items()}
+        start = time.perf_counter()
+        node.value = node.fn(**args)
+        node.seconds += time.perf_counter() - start
+        node.evaluations += 1
+        node.hop = self._hop
+        node.evaluated_at = self._now
+        return node.value
+
+    def step(self, now=None, **values):
+        """
+        Runs one hop: sets the given source values, then evaluates every sink.
+
+        Returns:
+          A dict of sink name -> value.
+        """
+        self._hop += 1
+        self._now = time.monotonic() if now is None else now
+        for name, value in values.items():
+            node = self.nodes[name]
+            node.value = value
+            node.hop = self._hop
+        return {name: self.pull(name) for name, node in self.nodes.items() if node.sink}
+
+    def report(self):
+        """Evaluations and mean milliseconds per node, in evaluation order."""
+        return {name: {"evaluations": self.nodes[name].evaluations,
+                       "mean_ms": 1000 * self.nodes[name].seconds / max(1, self.nodes[name].evaluations)}
+                for name in self.plan()}
+
+
+# Feature nodes. Each works on the shared power spectrogram of its audio, so
+# the STFT runs once per hop whichever features are requested.
+
+def pcm_samples(pcm):
+    """16-bit PCM bytes as float32 samples in [-1, 1]."""
+    return np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def raw_amplitude(pcm):
+    """Mean absolute amplitude on the 16-bit scale (feature_extraction's amplitude)."""
+    return float(np.abs(np.frombuffer(pcm, dtype=np.int16).astype(np.float32)).mean())
+
+
+def rms_gain(samples, target_rms=0.1):
+    """The gain feature_extraction2 applies to bring the audio to target_rms."""
+    return target_rms / (float(np.sqrt(np.mean(samples ** 2))) + 1e-6)
+
+
+def normalized_amplitude(samples, gain):
+    """Mean absolute amplitude after RMS normalization (feature_extraction2's amplitude)."""
+    return float(np.abs(samples).mean() * gain)
+
+
+def power_spectrogram(samples, n_fft=2048, hop_length=512):
+    return np.abs(librosa.stft(samples, n_fft=n_fft, hop_length=hop_length)) ** 2
+
+
+class MelFilter:
+    """Applies a mel filter bank that is built once rather than on every call."""
+
+    def __init__(self, sr, n_fft=2048, n_mels=64):
+        self.sr = sr
+        self.basis = librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=n_mels)
+
+    def __call__(self, power):
+        return self.basis @ power
+
+
+def spectral_centroid(mel, sr):
+    """Time-averaged spectral centroid of the mel spectrogram, as both feature extractors compute it."""
+    return float(np.mean(librosa.feature.spectral_centroid(S=mel, sr=sr)))
+
+
+def frequency_bands(mel, gain):
+    """
+    The 8 band energies of feature_extraction2. Normalizing the audio scales
+    its power spectrum by gain squared, so the bands come from the shared
+    unnormalized spectrogram.
+    """
+    return [float(band.mean()) * gain ** 2 for band in np.array_split(mel.mean(axis=1), NUM_BANDS)]
+
+
+def tempo(pcm, sr):
+    """BPM of a window of 16-bit PCM (0 if no beat was found)."""
+    from scheduler import estimate_tempo
+    return estimate_tempo(pcm, sr=sr)[0]
+
+
+def collect(**values):
+    """Gathers inputs into a features dict for the mappers."""
+    return values
+
+
+def add_audio_features(graph, audio, sr, prefix=None, n_fft=2048, hop_length=512, n_mels=64):
+    """
+    Declares the standard feature nodes on a PCM source, named "<prefix>.<feature>":
+    samples, gain, stft, mel, amplitude (16-bit scale), normalized_amplitude,
+    centroid and bands. Declaring them costs nothing; they only run if a sink needs them.
+    """
+    prefix = prefix or audio
+
+    def name(feature):
+        return f"{prefix}.{feature}"
+
+    mel = MelFilter(sr, n_fft=n_fft, n_mels=n_mels)
+    graph.add(name("samples"), pcm_samples, pcm=audio)
+    graph.add(name("gain"), rms_gain, samples=name("samples"))
+    graph.add(name("stft"), lambda samples: power_spectrogram(samples, n_fft, hop_length), samples=name("samples"))
+    graph.add(name("mel"), mel, power=name("stft"))
+    graph.add(name("amplitude"), raw_amplitude, pcm=audio)
+    graph.add(name("normalized_amplitude"), normalized_amplitude, samples=name("samples"), gain=name("gain"))
+    graph.add(name("centroid"), lambda mel: spectral_centroid(mel, sr), mel=name("mel"))
+    graph.add(name("bands"), frequency_bands, mel=name("mel"), gain=name("gain"))
+
+
+def add_mapper(graph, mapper, features, rate=None, name="prompt"):
+    """
+    Declares a prompt mapper node reading the "<features>.*" nodes.
+
+    Args:
+      mapper (str): "mapping" (raw amplitude and centroid only) or "mapping3"
+        (normalized amplitude, centroid and bands, plus an aesthetic path).
+    """
+    if mapper == "mapping":
+        import mapping
+        graph.add(f"{name}.features", collect, rate=rate,
+                  amplitude=f"{features}.amplitude", spectral_centroid=f"{features}.centroid")
+        graph.add(name, mapping.generate_prompt, rate=rate, features=f"{name}.features")
+    elif mapper == "mapping3":
+        import mapping3
+        graph.add(f"{name}.features", collect, rate=rate, amplitude=f"{features}.normalized_amplitude",
+                  spectral_centroid=f"{features}.centroid", frequency_bands=f"{features}.bands")
+        graph.add(name, lambda features: mapping3.generate_prompt(
+            features, path_type=mapping3.select_aesthetic_path(features)), rate=rate, features=f"{name}.features")
+    else:
+        raise ValueError(f"Unknown mapper {mapper!r}")
+    return name
+
+
+def brightness_and_hue(amplitude, centroid):
+    """The hue loop's mappings: 16-bit amplitude -> brightness offset, centroid -> hue shift."""
+    brightness = np.clip(amplitude / 3000 * 100, 0, 100) - 50
+    hue = np.clip((centroid - 2000) / 6000 * 180, 0, 180)
+    return int(brightness), int(hue)
+
+
+def main():
+    # Usage: python graph.py [mapping|mapping3] [--dry-run]
+    # Runs the audio -> features -> mapper -> generator -> effects -> display
+    # graph; --dry-run prints the prompts instead of generating images.
+    import cv2
+    from audio_capture import get_audio_stream, BackgroundRecorder, RATE
+    from visual_modes import adjust_brightness, adjust_hue
+
+    mapper = sys.argv[1] if len(sys.argv) > 1 and not sys.argv[1].startswith("--") else "mapping3"
+    dry_run = "--dry-run" in sys.argv
+
+    stream, p = get_audio_stream()
+    recorder = BackgroundRecorder(stream, max_seconds=TEMPO_WINDOW)
+    recorder.start()
+
+    graph = Graph()
+    graph.source("hop_audio", lambda: recorder.latest(HOP_SECONDS)[0])
+    graph.source("window_audio", lambda: recorder.latest(FEATURE_WINDOW)[0])
+    graph.source("tempo_audio", lambda: recorder.latest(TEMPO_WINDOW)[0])
+    add_audio_features(graph, "hop_audio", RATE, prefix="hop")
+    add_audio_features(graph, "window_audio", RATE, prefix="window")
+    graph.add("bpm", lambda pcm: tempo(pcm, RATE), rate=1.0, pcm="tempo_audio")
+    add_mapper(graph, mapper, "window", rate=GENERATION_INTERVAL)
+    graph.sink("console", lambda prompt, bpm: print(f"BPM {bpm:.1f}: {prompt}"),
+               rate=GENERATION_INTERVAL, prompt="prompt", bpm="bpm")
+
+    if not dry_run:
+        from generator import load_diffusion_model, generate_image
+        print("Loading diffusion model (this may take a few minutes)...")
+        pipe = load_diffusion_model()
+        graph.add("generator", lambda prompt: np.ascontiguousarray(
+            generate_image(pipe, prompt, output_type="np")[:, :, ::-1]), rate=GENERATION_INTERVAL, prompt="prompt")
+        graph.add("effect_params", brightness_and_hue, amplitude="hop.amplitude", centroid="hop.centroid")
+
+        def effects(image, params):
+            brightness, hue = params
+            return adjust_hue(adjust_brightness(image, brightness), hue)
+
+        graph.add("effects", effects, image="generator", params="effect_params")
+        graph.sink("display", lambda image: cv2.imshow("Generated Visuals", image), image="effects")
+
+    print(f"Processing graph ({mapper}):")
+    graph.describe()
+    time.sleep(TEMPO_WINDOW)
+    try:
+        while True:
+            graph.step()
+            if dry_run:
+                time.sleep(HOP_SECONDS)
+            elif cv2.waitKey(int(HOP_SECONDS * 1000)) & 0xFF == ord("q"):
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for name, stats in graph.report().items():
+            print(f"  {name:<28} {stats['evaluations']:>6} runs {stats['mean_ms']:9.2f} ms")
+        recorder.stop()
+        stream.stop_stream()
+        stream.close()
+        p.terminate()
+        cv2.destroyAllWindows()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# src/hot_reload.py
+import importlib
+import os
+import sys
+import threading
+import time
+import traceback
+import types
+
+import numpy as np
+
+
+def _check_mapping(module):
+    prompt = module.generate_prompt({"amplitude": 2000, "spectral_centroid": 4000})
+    assert isinstance(prompt, str), "generate_prompt must return a string"
+
+
+def _check_mapping3(module):
+    features = {"amplitude": 0.1, "spectral_centroid": 3000, "frequency_bands": [1.0] * 8}
+    path = module.select_aesthetic_path(features)
+    assert path in module.AESTHETIC_PATHS, f"unknown aesthetic path {path!r}"
+    assert isinstance(module.generate_prompt(features, path_type=path), str), "generate_prompt must return a string"
+
+
+def _check_visual_modes(module):
+    image = np.full((8, 8, 3), 128, dtype=np.uint8)
+    for effect in (module.adjust_brightness(image, 10), module.adjust_hue(image, 30)):
+        assert effect.shape == image.shape and effect.dtype == np.uint8, "effects must keep the image format"
+
+
+# Run on every new version before it is swapped in; a failure keeps the old one.
+SMOKE_TESTS = {
+    "mapping": _check_mapping,
+    "mapping3": _check_mapping3,
+    "visual_modes": _check_visual_modes,
+}
+
+
+class ModuleReloader:
+    """
+    Reloads mapping and effect modules while the visualizer keeps running.
+
+    check() looks at the source files (at most every `interval` seconds) and,
+    for each one that changed, executes it into a brand-new module object
+    and runs its smoke test. Only then is the new module swapped in, with a
+    single assignment, so a frame sees either the old version or the new
+    one, never a half-reloaded module. If the new source fails to import or
+    to pass its test, the error is printed and the old version stays.
+
+    Everything else in the process (the loaded pipeline, the audio stream,
+    caches) is untouched. Callers look functions up through the reloader
+    (reloader["mapping3"].generate_prompt, or call()) instead of importing
+    them by name, and call check() between frames. check() and call() may
+    run on different threads: the swap bookkeeping is done under a lock, and
+    functions run outside it on the version current when they were looked up.
+
+    Args:
+      *names: Names of already imported modules to watch.
+      interval (float): Seconds between file checks.
+      tests (dict): Module name -> smoke test taking the new module; SMOKE_TESTS by default.
+    """
+
+    def __init__(self, *names, interval=1.0, tests=None):
+        self.interval = interval
+        self.tests = SMOKE_TESTS if tests is None else tests
+        self.modules = {}
+        self.previous = {}
+        self._proven = {}  # module name -> functions that have run on the new version
+        self._stamps = {}
+        self._last_check = 0.0
+        self._lock = threading.RLock()  # reentrant: check() reloads, call() rolls back
+        for name in names:
+            module = sys.modules.get(name) or importlib.import_module(name)
+            self.modules[name] = module
+            self._stamps[name] = self._stamp(module.__file__)
+
+    def __getitem__(self, name):
+        with self._lock:
+            return self.modules[name]
+
+    @staticmethod
+    def _stamp(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None  # mid-save by an editor that replaces the file
+        return stat.st_mtime_ns, stat.st_size
+
+    def check(self):
+        """Reloads changed modules; returns the names that were swapped in."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_check < self.interval:
+                return []
+            self._last_check = now
+            swapped = []
+            for name, module in list(self.modules.items()):
+                stamp = self._stamp(module.__file__)
+                if stamp is None or stamp == self._stamps[name]:
+                    continue
+                self._stamps[name] = stamp  # don't retry a broken version until it changes again
+                if self.reload(name):
+                    swapped.append(name)
+            return swapped
+
+    def reload(self, name):
+        """Loads a fresh copy of a module and swaps it in if it works; returns whether it did."""
+        with self._lock:
+            path = self.modules[name].__file__
+            try:
+                # Compiled from the source itself: a cached .pyc from an edit in the
+                # same second could otherwise be mistaken for the new version.
+                with open(path) as f:
+                    source = f.read()
+                module = types.ModuleType(name)
+                module.__file__ = path
+                exec(compile(source, path, "exec"), module.__dict__)
+                if name in self.tests:
+                    self.tests[name](module)
+            except Exception:
+                print(f"Reloading {name} failed; keeping the running version:\n{traceback.format_exc()}")
+                return False
+            self.previous[name] = self.modules[name]
+            self._proven[name] = set()
+            self.modules[name] = module
+            sys.modules[name] = module
+            print(f"Reloaded {name} from {path}")
+            return True
+
+    def rollback(self, name):
+        """Goes back to the version that was running before the last reload."""
+        with self._lock:
+            if name in self.previous:
+                self.modules[name] = sys.modules[name] = self.previous.pop(name)
+                self._proven.pop(name, None)
+                print(f"Rolled {name} back to the previous version")
+
+    def call(self, name, function, *args, **kwargs):
+        """
+        Calls module `name`'s `function`. If a freshly reloaded version raises
+        the first time this function runs on it, the module is rolled back and
+        the call is retried with the previous version. Once a function has
+        succeeded on the new version, its later exceptions propagate as usual:
+        they come from the inputs, not from the reload.
+        """
+        with self._lock:
+            module = self.modules[name]
+            fresh = name in self.previous and function not in self._proven[name]
+        try:
+            result = getattr(module, function)(*args, **kwargs)
+        except Exception:
+            if not fresh:
+                raise
+            print(f"{name}.{function} raised after reloading:\n{traceback.format_exc()}")
+            with self._lock:
+                if self.modules[name] is module:  # not already swapped by another thread
+                    self.rollback(name)
+                module = self.modules[name]
+            return getattr(module, function)(*args, **kwargs)
+        with self._lock:
+            if fresh and self.modules[name] is module:
+                self._proven[name].add(function)
+        return result
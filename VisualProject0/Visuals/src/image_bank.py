@@ -0,0 +1,326 @@
+# src/image_bank.py
+import json
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import mapping3
+
+INDEX_FILE = "index.json"
+
+
+def _mapping3():
+    # Looked up on every use rather than imported by name, so a version
+    # swapped in by hot_reload.ModuleReloader is picked up.
+    return sys.modules["mapping3"]
+
+
+def _feature_vector(features):
+    """Amplitude and the 8 band energies on a log scale, used to match live audio to frames."""
+    bands = list(features.get("frequency_bands", [0] * 8))
+    return np.log1p(np.abs(np.array([features.get("amplitude", 0)] + bands, dtype=np.float32)))
+
+
+def _jsonable(features):
+    return {key: (np.asarray(value).tolist() if isinstance(value, (list, tuple, np.ndarray))
+                  else float(value))
+            for key, value in features.items()}
+
+
+class ImageBankWriter:
+    """
+    Appends pre-rendered frames to an image bank.
+
+    A bank is a directory holding, per aesthetic path, one raw file of
+    consecutive H x W x 3 uint8 BGR frames, plus an index.json describing
+    the frame size and the features and prompt each frame was rendered from.
+    Opening an existing bank appends to it. The index is the source of
+    truth: frame offsets are derived from its counts and it is replaced
+    atomically, so an interrupted build never misaligns the frames.
+    """
+
+    def __init__(self, bank_dir, height=512, width=512):
+        self.bank_dir = bank_dir
+        os.makedirs(bank_dir, exist_ok=True)
+        index_path = os.path.join(bank_dir, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                self.index = json.load(f)
+        else:
+            self.index = {"height": height, "width": width, "paths": {}}
+        self.height = self.index["height"]
+        self.width = self.index["width"]
+        self.frame_bytes = self.height * self.width * 3
+        # Frames written after the last index update (e.g. before a crash) are
+        # not described by it; cut them off so the files match the index again.
+        for entry in self.index["paths"].values():
+            data_path = os.path.join(bank_dir, entry["file"])
+            size = len(entry["frames"]) * self.frame_bytes
+            if os.path.exists(data_path) and os.path.getsize(data_path) > size:
+                os.truncate(data_path, size)
+
+    def add(self, path, frame, features, prompt="", rgb=False):
+        """
+        Appends one frame to the given aesthetic path.
+
+        Args:
+          path (str): The aesthetic path the frame belongs to.
+          frame (np.ndarray): H x W x 3 uint8 image; resized if it does not match the bank.
+          features (dict): The audio features the frame was rendered from.
+          prompt (str): The prompt used to render it.
+          rgb (bool): True if frame is RGB (e.g. diffusion output) rather than BGR.
+        """
+        if rgb:
+            frame = frame[:, :, ::-1]
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        if frame.shape[:2] != (self.height, self.width):
+            frame = cv2.resize(frame, (self.width, self.height), interpolation=cv2.INTER_AREA)
+        entry = self.index["paths"].setdefault(path, {"file": f"{path}.u8", "frames": []})
+        data_path = os.path.join(self.bank_dir, entry["file"])
+        # The offset comes from the index, not the file size, so leftovers
+        # from an interrupted add are overwritten rather than shifting frames.
+        with open(data_path, "r+b" if os.path.exists(data_path) else "wb") as f:
+            f.seek(len(entry["frames"]) * self.frame_bytes)
+            f.write(frame.tobytes())
+            f.truncate()
+        entry["frames"].append({"features": _jsonable(features), "prompt": prompt})
+
+    def close(self):
+        """Writes the index; frames added before a crash stay readable up to the last close()."""
+        index_path = os.path.join(self.bank_dir, INDEX_FILE)
+        with open(index_path + ".tmp", "w") as f:
+            json.dump(self.index, f)
+        os.replace(index_path + ".tmp", index_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ImageBank:
+    """
+    Read-only view of an image bank. Each path's frames are a memory-mapped
+    (count, H, W, 3) uint8 array, so selecting a frame never copies it.
+    """
+
+    def __init__(self, bank_dir):
+        with open(os.path.join(bank_dir, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        self.height = self.index["height"]
+        self.width = self.index["width"]
+        self.frames = {}
+        self.vectors = {}
+        for path, entry in self.index["paths"].items():
+            count = len(entry["frames"])
+            if count == 0:
+                continue
+            self.frames[path] = np.memmap(os.path.join(bank_dir, entry["file"]), dtype=np.uint8,
+                                          mode="r", shape=(count, self.height, self.width, 3))
+            self.vectors[path] = np.stack([_feature_vector(frame["features"])
+                                           for frame in entry["frames"]])
+
+    @property
+    def paths(self):
+        return list(self.frames)
+
+    def select(self, features):
+        """
+        Picks the frame whose recorded features are closest to the live ones,
+        within the aesthetic path mapping3 selects for them (or any path if
+        the bank has none for it).
+
+        Returns:
+          A tuple (path, frame_index).
+        """
+        path = _mapping3().select_aesthetic_path(features)
+        if path not in self.frames:
+            path = None
+        vector = _feature_vector(features)
+        best = None
+        for candidate in ([path] if path else self.paths):
+            distances = np.sum((self.vectors[candidate] - vector) ** 2, axis=1)
+            i = int(np.argmin(distances))
+            if best is None or distances[i] < best[0]:
+                best = (distances[i], candidate, i)
+        return best[1], best[2]
+
+    def frame(self, path, i):
+        """The i-th frame of a path, as a zero-copy view into the memory map."""
+        return self.frames[path][i]
+
+
+class CrossfadePlayer:
+    """
+    Crossfades between frames into preallocated buffers, so steady-state
+    playback allocates nothing per frame.
+    """
+
+    def __init__(self, height, width, fade_frames=30):
+        self.fade_frames = fade_frames
+        self.output = np.zeros((height, width, 3), dtype=np.uint8)
+        self._from = np.zeros_like(self.output)
+        self._to = None
+        self._key = None
+        self._progress = fade_frames
+
+    def show(self, frame, key=None):
+        """
+        Starts fading from whatever is on screen now into frame. Repeated calls
+        with the same key (e.g. the bank's (path, index)) keep the current fade.
+        """
+        if key is not None and key == self._key:
+            return
+        np.copyto(self._from, self.output)
+        self._to = frame
+        self._key = key
+        self._progress = 0
+
+    def next_frame(self):
+        """Advances the fade by one frame and returns the output buffer."""
+        if self._to is None:
+            return self.output
+        if self._progress < self.fade_frames:
+            self._progress += 1
+            alpha = self._progress / self.fade_frames
+            # Smoothstep easing so the fade starts and ends gently.
+            alpha = alpha * alpha * (3 - 2 * alpha)
+            cv2.addWeighted(self._to, alpha, self._from, 1 - alpha, 0, dst=self.output)
+        elif self._progress == self.fade_frames:
+            np.copyto(self.output, self._to)
+            self._progress += 1
+        return self.output
+
+
+def build_bank(pipe, bank_dir, feature_sets, height=512, width=512, num_inference_steps=50, workers=1):
+    """
+    Pre-renders one frame per feature set into an image bank. The diffusion
+    output is requested as NumPy, so frames go to disk without touching PIL.
+    With workers > 1 the frames are rendered in parallel by a GenerationPool.
+    """
+    from generator import generate_image
+
+    jobs = []
+    for features in feature_sets:
+        path = _mapping3().select_aesthetic_path(features)
+        jobs.append((features, path, _mapping3().generate_prompt(features, path_type=path)))
+
+    pool = None
+    if workers > 1:
+        from generation_pool import GenerationPool
+        pool = GenerationPool(pipe, workers=workers)
+        # Earlier frames get a higher priority so the bank fills in order.
+        futures = [pool.submit(prompt, priority=n, num_inference_steps=num_inference_steps)
+                   for n, (_, _, prompt) in enumerate(jobs)]
+
+    try:
+        with ImageBankWriter(bank_dir, height, width) as writer:
+            for n, (features, path, prompt) in enumerate(jobs, start=1):
+                print(f"[{n}/{len(jobs)}] {path}: {prompt}")
+                if pool is not None:
+                    image = futures[n - 1].result()
+                else:
+                    image = generate_image(pipe, prompt, num_inference_steps=num_inference_steps,
+                                           output_type="np")
+                writer.add(path, image, features, prompt, rgb=True)
+                writer.close()  # keep the index current if the build is interrupted
+    finally:
+        if pool is not None:
+            pool.close()
+
+
+def play_bank(bank, get_features, fps=60, fade_frames=30, window="Image Bank"):
+    """
+    Displays frames from the bank at a fixed frame rate, crossfading whenever
+    the live features select a different frame. get_features() must return
+    the latest feature dict (or None) without blocking.
+    """
+    player = CrossfadePlayer(bank.height, bank.width, fade_frames)
+    frame_time = 1.0 / fps
+    next_time = time.monotonic()
+    while True:
+        features = get_features()
+        if features is not None:
+            key = bank.select(features)
+            player.show(bank.frame(*key), key)
+        cv2.imshow(window, player.next_frame())
+        if cv2.waitKey(1) & 0xFF == ord("q"):
+            break
+        next_time += frame_time
+        delay = next_time - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            next_time = time.monotonic()
+
+
+def features_from_file(audio_path, window_sec=5):
+    """Extracts one feature set per window_sec of an audio file, for building a bank offline."""
+    import librosa
+    from audio_capture import RATE
+    from feature_extraction2 import extract_features
+
+    audio, _ = librosa.load(audio_path, sr=RATE, mono=True)
+    pcm = (np.clip(audio, -1, 1) * 32767).astype(np.int16)
+    step = int(RATE * window_sec)
+    return [extract_features(pcm[i:i + step].tobytes(), sr=RATE)
+            for i in range(0, len(pcm) - step + 1, step)]
+
+
+def main():
+    # Usage: python image_bank.py build BANK_DIR AUDIO_FILE [...] [--workers N]
+    #        python image_bank.py play BANK_DIR
+    command, bank_dir = sys.argv[1], sys.argv[2]
+    if command == "build":
+        from generator import load_diffusion_model
+        args = sys.argv[3:]
+        workers = 1
+        if "--workers" in args:
+            i = args.index("--workers")
+            workers = int(args[i + 1])
+            del args[i:i + 2]
+        feature_sets = [f for audio_path in args for f in features_from_file(audio_path)]
+        print("Loading diffusion model (this may take a few minutes)...")
+        pipe = load_diffusion_model(device="cpu" if workers > 1 else None)
+        build_bank(pipe, bank_dir, feature_sets, workers=workers)
+        return
+
+    from audio_capture import get_audio_stream, BackgroundRecorder, RATE
+    from feature_extraction2 import extract_features
+
+    bank = ImageBank(bank_dir)
+    stream, p = get_audio_stream()
+    recorder = BackgroundRecorder(stream, max_seconds=2)
+    recorder.start()
+    latest = {"features": None}
+    stop = threading.Event()
+
+    def analyse():
+        # Feature extraction runs off the display thread so it never drops frames.
+        while not stop.is_set():
+            audio_data, _ = recorder.latest(1)
+            if audio_data:
+                latest["features"] = extract_features(audio_data, sr=RATE)
+            time.sleep(0.1)
+
+    threading.Thread(target=analyse, daemon=True).start()
+    try:
+        play_bank(bank, lambda: latest["features"])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        recorder.stop()
+        stream.stop_stream()
+        stream.close()
+        p.terminate()
+        cv2.destroyAllWindows()
+
+
+if __name__ == "__main__":
+    main()
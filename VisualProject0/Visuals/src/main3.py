@@ -0,0 +1,161 @@
+# src/main3.py
+import threading
+import time
+import cv2
+import numpy as np
+from audio_capture import get_audio_stream, BackgroundRecorder, RATE
+from feature_extraction2 import extract_features
+from hot_reload import ModuleReloader
+from generator import load_diffusion_model, generate_image
+from scheduler import BeatClock, BeatScheduler, estimate_tempo
+from timeline import TimelineRecorder, as_recorded
+from feature_bus import FeatureSubscriber
+
+# Seconds of audio used for tempo tracking and for the prompt features.
+TEMPO_WINDOW = 10
+FEATURE_WINDOW = 5
+# New images are swapped in every 4-bar phrase.
+BOUNDARY_BEATS = 16
+# Each session's features, aesthetic paths and prompts are recorded here
+# (replay with: python timeline.py replay FILE).
+SESSION_DIR = "sessions"
+HOP_SECONDS = 0.5
+# Name of a running feature bus (python feature_bus.py) to read features and
+# tempo from instead of analysing a private audio stream; None opens the stream.
+FEATURE_BUS = None
+# Peak RSS in MB a generation may use on a CPU-only node; the generator picks
+# a lower-memory strategy to fit it. None loads the full pipeline.
+MEMORY_BUDGET_MB = None
+# Reload mapping3 when it is saved, between generations, keeping the model and
+# audio open (a broken edit keeps the running version). Off by default: it
+# executes whatever is saved to mapping3.py while the visualizer runs.
+HOT_RELOAD = False
+# Port to stream the images to browsers and remote displays from (see
+# frame_server.py); None disables streaming.
+STREAM_PORT = None
+# Interface the stream listens on. The stream has no authentication, so it
+# stays on this machine unless set to "0.0.0.0" to serve the local network.
+STREAM_HOST = "127.0.0.1"
+
+
+def main():
+    # Load the diffusion model (this may take a few minutes)
+    print("Loading diffusion model (this may take a few minutes)...")
+    pipe = load_diffusion_model(memory_budget_mb=MEMORY_BUDGET_MB)
+    print("Diffusion model loaded.")
+
+    reloader = ModuleReloader("mapping3")
+    server = None
+    if STREAM_PORT:
+        from frame_server import FrameServer
+        server = FrameServer(STREAM_HOST, STREAM_PORT)
+        print(f"Streaming at {server.url} (/stream.mjpg, /ws, /stats)")
+    clock = BeatClock()
+    stream = recorder = bus = None
+    if FEATURE_BUS:
+        bus = FeatureSubscriber(FEATURE_BUS)
+        print(f"Reading features from the {FEATURE_BUS!r} feature bus.")
+
+        def current_features(seconds):
+            features = bus.average(seconds) or {}
+            if features:
+                # The diffusion mappings expect the RMS-normalized amplitude.
+                features["amplitude"] = features["normalized_amplitude"]
+            return features
+
+        def update_tempo():
+            features = bus.latest()
+            if features and features["bpm"] > 0:
+                clock.update(features["bpm"], features["beat_time"])
+    else:
+        # Set up audio stream; recording continues in the background while generating.
+        stream, p = get_audio_stream()
+        recorder = BackgroundRecorder(stream, max_seconds=TEMPO_WINDOW)
+        recorder.start()
+        print(f"Audio stream started. Listening for {TEMPO_WINDOW} seconds...")
+        # The bus already holds a tempo estimate; a private stream needs a full window first.
+        time.sleep(TEMPO_WINDOW)
+
+        def current_features(seconds):
+            audio_data, _ = recorder.latest(seconds)
+            return extract_features(audio_data, sr=RATE)
+
+        def update_tempo():
+            audio_data, end_time = recorder.latest(TEMPO_WINDOW)
+            bpm, last_beat_offset = estimate_tempo(audio_data, sr=RATE)
+            if bpm > 0:
+                clock.update(bpm, end_time - last_beat_offset)
+
+    session_file = f"{SESSION_DIR}/{time.strftime('%Y%m%d-%H%M%S')}.vptl"
+    timeline = TimelineRecorder(session_file)
+    print(f"Recording feature timeline to {session_file}")
+    stop_hops = threading.Event()
+
+    def record_hops():
+        # Per-hop features for the timeline, recorded independently of generation.
+        while not stop_hops.wait(HOP_SECONDS):
+            features = as_recorded(current_features(HOP_SECONDS))
+            timeline.record(features, reloader.call("mapping3", "select_aesthetic_path", features))
+
+    hop_thread = threading.Thread(target=record_hops, daemon=True)
+    hop_thread.start()
+
+    scheduler = BeatScheduler(clock, steps=50, min_steps=15, boundary_beats=BOUNDARY_BEATS)
+
+    def generate(steps):
+        # Features are taken when the job actually starts, so the image reflects
+        # the most recent audio rather than the audio at planning time.
+        # The mapping sees the features exactly as the timeline stores them,
+        # so a replay of the session reproduces this path and prompt.
+        features = as_recorded(current_features(FEATURE_WINDOW))
+        path = reloader.call("mapping3", "select_aesthetic_path", features)
+        prompt = reloader.call("mapping3", "generate_prompt", features, path_type=path)
+        timeline.record(features, path, prompt)
+        print(f"Generating with {steps} steps: {prompt}")
+        return generate_image(pipe, prompt, num_inference_steps=steps, output_type="np")
+
+    try:
+        while True:
+            if HOT_RELOAD:
+                reloader.check()
+            update_tempo()
+            plan = scheduler.plan()
+            print(f"BPM: {clock.bpm:.1f}, {plan}")
+            image = scheduler.run(plan, generate)
+            if image is None:
+                print("Skipped: the job could not make its target beat.")
+            else:
+                # The pipeline returns RGB NumPy directly; flip to BGR for OpenCV.
+                frame = np.ascontiguousarray(image[:, :, ::-1])
+                cv2.imshow("Generated Visuals", frame)
+                if server is not None:
+                    server.publish(frame)
+
+            report = scheduler.report()
+            print(f"Beat hit rate: {report['hit_rate']:.0%} "
+                  f"({report['hits']}/{report['targeted']}, "
+                  f"{report['downgraded']} downgraded, {report['skipped']} skipped)")
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("Scheduler report:", scheduler.report())
+        stop_hops.set()
+        hop_thread.join()
+        timeline.close()
+        if server is not None:
+            server.report()
+            server.close()
+        if bus is not None:
+            bus.close()
+        else:
+            recorder.stop()
+            stream.stop_stream()
+            stream.close()
+            p.terminate()
+        cv2.destroyAllWindows()
+
+
+if __name__ == "__main__":
+    main()
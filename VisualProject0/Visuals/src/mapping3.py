@@ -1,6 +1,13 @@
 import random
 import hashlib
 
+# Every aesthetic path, in a fixed order (the timeline recorder stores the index).
+AESTHETIC_PATHS = (
+    "tribal", "natural", "industrial", "minimal_abstract",
+    "hybrid_organic_industrial", "dark_surreal", "primal_wilderness",
+    "cosmic_natural", "apocalyptic_vision", "biomorphic_abstraction",
+    "mystical_ethereal",
+)
 
 def select_aesthetic_path(features):
     """
@@ -109,12 +116,7 @@ def generate_prompt(features, path_type=None, image_index=1, n_prompts=1):
       A single prompt string (if n_prompts==1) or a list of prompt strings.
     """
     # Automatically select an aesthetic path if none is provided.
-    if path_type not in {
-        "tribal", "natural", "industrial", "minimal_abstract",
-        "hybrid_organic_industrial", "dark_surreal", "primal_wilderness",
-        "cosmic_natural", "apocalyptic_vision", "biomorphic_abstraction",
-        "mystical_ethereal"
-    }:
+    if path_type not in AESTHETIC_PATHS:
         path_type = select_aesthetic_path(features)
 
     # Define aesthetic options for each path.
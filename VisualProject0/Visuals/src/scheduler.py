@@ -0,0 +1,254 @@
+# src/scheduler.py
+import math
+import time
+from collections import deque
+
+import numpy as np
+import librosa
+
+
+def estimate_tempo(audio_data, sr=22050):
+    """
+    Estimates the tempo and beat phase of 16-bit PCM byte data with librosa's
+    beat tracker (the same estimator the techno visualizer uses for its BPM).
+
+    Returns:
+      A tuple (bpm, last_beat_offset): the tempo in beats per minute (0 if no
+      beat was found) and the time in seconds from the last detected beat to
+      the end of the audio.
+    """
+    audio_np = np.frombuffer(audio_data, dtype=np.int16).astype(np.float32) / 32768.0
+    tempo, beats = librosa.beat.beat_track(y=audio_np, sr=sr, units="time")
+    bpm = float(np.atleast_1d(tempo)[0])
+    if bpm <= 0 or len(beats) == 0:
+        return 0.0, 0.0
+    duration = len(audio_np) / sr
+    return bpm, duration - float(beats[-1])
+
+
+class BeatClock:
+    """
+    Extrapolates the beat grid from the latest tempo and beat-time estimates.
+
+    The beat tracker only reports beats, not downbeats, so the first observed
+    beat is taken as a downbeat and later updates keep the bar count aligned
+    to it while following tempo drift.
+    """
+
+    def __init__(self, beats_per_bar=4):
+        self.beats_per_bar = beats_per_bar
+        self.bpm = 0.0
+        self.anchor = None  # time of a (presumed) downbeat
+
+    @property
+    def period(self):
+        """Seconds per beat, or None before a tempo is known."""
+        return 60.0 / self.bpm if self.bpm > 0 else None
+
+    def update(self, bpm, beat_time):
+        """Re-anchors the grid on an observed beat at beat_time (time.monotonic() base)."""
+        if bpm <= 0:
+            return
+        if self.anchor is None:
+            self.bpm = bpm
+            self.anchor = beat_time
+            return
+        # Number the new beat on the old grid so downbeats stay on the same beat.
+        beats_since = round((beat_time - self.anchor) / self.period)
+        self.bpm = bpm
+        self.anchor = beat_time - (beats_since % self.beats_per_bar) * self.period
+
+    def beat_phase(self, t=None):
+        """Position within the current beat, in [0, 1)."""
+        if self.anchor is None:
+            return 0.0
+        t = time.monotonic() if t is None else t
+        return ((t - self.anchor) / self.period) % 1.0
+
+    def next_boundary(self, t, beats):
+        """Returns the first time >= t that falls on a multiple of `beats` beats from a downbeat."""
+        span = beats * self.period
+        return self.anchor + math.ceil((t - self.anchor) / span) * span
+
+
+class LatencyModel:
+    """
+    Rolling model of generate_image latency as a function of the step count.
+
+    Fits seconds = overhead + per_step * steps over the recent window and adds
+    a high quantile of the residuals, so predictions are pessimistic rather
+    than average.
+    """
+
+    def __init__(self, window=20, quantile=0.9):
+        self.samples = deque(maxlen=window)  # (steps, seconds)
+        self.quantile = quantile
+
+    def record(self, steps, seconds):
+        self.samples.append((steps, seconds))
+
+    def predict(self, steps):
+        """Predicted seconds for a run of `steps` steps, or None without measurements."""
+        if not self.samples:
+            return None
+        s = np.array([x[0] for x in self.samples], dtype=float)
+        y = np.array([x[1] for x in self.samples], dtype=float)
+        if len(np.unique(s)) > 1:
+            per_step, overhead = np.polyfit(s, y, 1)
+            per_step = max(per_step, 0.0)
+            overhead = max(overhead, 0.0)
+            residual = np.quantile(y - (overhead + per_step * s), self.quantile)
+            return overhead + per_step * steps + max(residual, 0.0)
+        # A single step count so far, so overhead and per-step cost can't be
+        # told apart: assume fewer steps save nothing and more steps scale the
+        # whole run, which overestimates either way until a second count is seen.
+        return float(np.quantile(y, self.quantile)) * max(steps / s[0], 1.0)
+
+
+class GenerationPlan:
+    """When to start a generation, with how many steps, and which beat it should land on."""
+
+    def __init__(self, start_at, target, steps):
+        self.start_at = start_at
+        self.target = target
+        self.steps = steps
+
+    def __repr__(self):
+        return f"GenerationPlan(start_at={self.start_at:.2f}, target={self.target}, steps={self.steps})"
+
+
+class BeatScheduler:
+    """
+    Schedules diffusion generations so each finished image is ready on a beat boundary.
+
+    Args:
+      clock (BeatClock): The beat grid to align to.
+      latency (LatencyModel): Measured generation latency; one is created if omitted.
+      steps (int): Preferred num_inference_steps.
+      min_steps (int): Fewest steps a job may be downgraded to before it is skipped.
+      boundary_beats (int): Beats between swap points (4 = every bar, 16 = every 4-bar phrase).
+      margin (float): Seconds of safety added to every latency prediction.
+      max_delay (float): Extra seconds a job may wait beyond the earliest reachable
+        boundary in order to keep more steps (0 = always take the earliest boundary).
+    """
+
+    def __init__(self, clock, latency=None, steps=50, min_steps=15, boundary_beats=4,
+                 margin=0.1, max_delay=0.0):
+        self.clock = clock
+        self.latency = latency or LatencyModel()
+        self.steps = steps
+        self.min_steps = min_steps
+        self.boundary_beats = boundary_beats
+        self.margin = margin
+        self.max_delay = max_delay
+        self.stats = {"jobs": 0, "targeted": 0, "hits": 0, "misses": 0,
+                      "skipped": 0, "downgraded": 0, "miss_seconds": 0.0, "max_miss_seconds": 0.0}
+
+    def _step_candidates(self):
+        """Step counts to try, from the preferred count down to min_steps."""
+        candidates = []
+        steps = self.steps
+        while steps > self.min_steps:
+            candidates.append(steps)
+            steps = int(steps * 0.75)
+        candidates.append(self.min_steps)
+        return candidates
+
+    def _ready_time(self, now, steps):
+        return now + self.latency.predict(steps) + self.margin
+
+    def plan(self, now=None, deadline=None):
+        """
+        Plans the next generation.
+
+        Without a tempo or any latency measurements yet, the job starts
+        immediately with the preferred steps and no target beat.
+
+        Args:
+          now (float): Current time.monotonic(); read if omitted.
+          deadline (float): Latest acceptable target time, if any.
+
+        Returns:
+          A GenerationPlan, or None if the job cannot make its deadline even at min_steps.
+        """
+        now = time.monotonic() if now is None else now
+        if self.clock.period is None or self.latency.predict(self.steps) is None:
+            return GenerationPlan(now, None, self.steps)
+
+        candidates = self._step_candidates()
+        earliest = self.clock.next_boundary(self._ready_time(now, candidates[-1]),
+                                            self.boundary_beats)
+        if deadline is not None and earliest > deadline:
+            return None
+        limit = earliest + self.max_delay
+        if deadline is not None:
+            limit = min(limit, deadline)
+        for steps in candidates:
+            target = self.clock.next_boundary(self._ready_time(now, steps), self.boundary_beats)
+            if target <= limit:
+                start_at = target - (self.latency.predict(steps) + self.margin)
+                return GenerationPlan(max(now, start_at), target, steps)
+        return GenerationPlan(now, earliest, candidates[-1])
+
+    def run(self, plan, generate):
+        """
+        Executes a plan: waits for its start time, calls generate(steps), then
+        holds the result until the target beat so the caller can swap it in.
+
+        If the start slipped so far that the planned steps can no longer make
+        the target, the job is downgraded, or skipped when even min_steps
+        would be late.
+
+        Args:
+          plan (GenerationPlan): A plan from plan(); None (a deadline that
+            could not be met) counts as a skipped job.
+          generate (callable): Called with the step count.
+
+        Returns:
+          The value returned by generate, or None if the job was skipped.
+        """
+        self.stats["jobs"] += 1
+        if plan is None:
+            self.stats["skipped"] += 1
+            return None
+        now = time.monotonic()
+        if plan.start_at > now:
+            time.sleep(plan.start_at - now)
+            now = time.monotonic()
+
+        steps = plan.steps
+        if plan.target is not None:
+            if self._ready_time(now, steps) > plan.target:
+                fitting = [s for s in self._step_candidates()
+                           if self._ready_time(now, s) <= plan.target]
+                if not fitting:
+                    self.stats["skipped"] += 1
+                    return None
+                steps = fitting[0]
+            if steps < self.steps:
+                self.stats["downgraded"] += 1
+            self.stats["targeted"] += 1
+
+        start = time.monotonic()
+        result = generate(steps)
+        finished = time.monotonic()
+        self.latency.record(steps, finished - start)
+
+        if plan.target is not None:
+            lateness = finished - plan.target
+            if lateness <= 0:
+                self.stats["hits"] += 1
+                time.sleep(-lateness)
+            else:
+                # Running totals rather than a list, so a long show doesn't grow the stats.
+                self.stats["misses"] += 1
+                self.stats["miss_seconds"] += lateness
+                self.stats["max_miss_seconds"] = max(self.stats["max_miss_seconds"], lateness)
+        return result
+
+    def report(self):
+        """Returns the hit rate against target beats along with the job counters."""
+        stats = dict(self.stats)
+        stats["hit_rate"] = stats["hits"] / stats["targeted"] if stats["targeted"] else 0.0
+        stats["mean_miss_seconds"] = stats["miss_seconds"] / stats["misses"] if stats["misses"] else 0.0
+        return stats
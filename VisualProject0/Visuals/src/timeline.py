@@ -0,0 +1,412 @@
+# src/timeline.py
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+import mapping3
+
+# File layout: a 16-byte header, then any number of chunks. Each chunk is an
+# 8-byte header (magic, row count) followed by one contiguous array per column,
+# padded to 8 bytes. Chunks are only ever appended, so a file that was cut
+# short by a crash is still readable up to its last complete chunk.
+FILE_MAGIC = b"VPTL"
+CHUNK_MAGIC = b"CHNK"
+VERSION = 1
+NUM_BANDS = 8
+FILE_HEADER = struct.Struct("<4sII4x")
+CHUNK_HEADER = struct.Struct("<4sI")
+
+# (name, dtype, values per row), ordered largest dtype first to keep columns aligned.
+COLUMNS = (
+    ("timestamp", np.float64, 1),
+    ("prompt_key", np.int64, 1),
+    ("amplitude", np.float32, 1),
+    ("spectral_centroid", np.float32, 1),
+    ("frequency_bands", np.float32, NUM_BANDS),
+    ("path", np.uint8, 1),
+)
+NO_PATH = 255
+NO_PROMPT = 0
+
+
+def _mapping3():
+    # Looked up on every use rather than imported by name, so a version
+    # swapped in by hot_reload.ModuleReloader is picked up.
+    return sys.modules["mapping3"]
+
+
+def _chunk_size(rows):
+    size = sum(np.dtype(dtype).itemsize * width * rows for _, dtype, width in COLUMNS)
+    return CHUNK_HEADER.size + (size + 7) // 8 * 8
+
+
+def _chunks(buffer):
+    """Yields (offset, rows) for every complete chunk in a timeline file's bytes."""
+    offset = FILE_HEADER.size
+    while offset + CHUNK_HEADER.size <= len(buffer):
+        magic, n = CHUNK_HEADER.unpack_from(buffer, offset)
+        size = _chunk_size(n)
+        if magic != CHUNK_MAGIC or offset + size > len(buffer):
+            return  # truncated tail from an interrupted write
+        yield offset, n
+        offset += size
+
+
+def as_recorded(features):
+    """
+    The features exactly as a timeline row reads them back: only the recorded
+    fields, at float32 precision, as plain floats. The mapping stage is given
+    these, so replaying a session reproduces the recorded paths and prompts
+    (generate_prompt seeds on the exact values).
+    """
+    return {
+        "amplitude": float(np.float32(features.get("amplitude", 0))),
+        "spectral_centroid": float(np.float32(features.get("spectral_centroid", 0))),
+        "frequency_bands": np.asarray(features.get("frequency_bands", [0] * NUM_BANDS),
+                                      dtype=np.float32).tolist(),
+    }
+
+
+def prompt_key(prompt):
+    """A stable 63-bit key for a prompt (0 means no prompt)."""
+    if not prompt:
+        return NO_PROMPT
+    return int(hashlib.md5(prompt.encode()).hexdigest()[:15], 16) + 1
+
+
+class TimelineRecorder:
+    """
+    Records per-hop features to an append-only columnar timeline file.
+
+    record() only enqueues the values; a background thread packs them into
+    columnar chunks of up to chunk_rows rows and appends them with buffered
+    writes, at least every flush_interval seconds. Prompt texts go to a
+    "<file>.prompts" side file, keyed by prompt_key().
+    """
+
+    def __init__(self, filename, chunk_rows=1024, flush_interval=1.0):
+        self.filename = filename
+        self.chunk_rows = chunk_rows
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._known_prompts = set()
+
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        new_file = self._truncate_partial(filename)
+        self._file = open(filename, "ab", buffering=1 << 20)
+        if new_file:
+            self._file.write(FILE_HEADER.pack(FILE_MAGIC, VERSION, NUM_BANDS))
+        self._prompts = open(filename + ".prompts", "a")
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _truncate_partial(filename):
+        """
+        Cuts an existing file back to its last complete chunk (and its prompt
+        file to its last complete line), so rows appended after a crash stay
+        readable. Returns True if the file is new or empty.
+        """
+        if not os.path.exists(filename) or os.path.getsize(filename) < FILE_HEADER.size:
+            open(filename, "wb").close()
+            return True
+        with open(filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            magic, version, num_bands = FILE_HEADER.unpack_from(buffer, 0)
+            if magic != FILE_MAGIC or num_bands != NUM_BANDS:
+                raise ValueError(f"{filename} is not a feature timeline")
+            end = FILE_HEADER.size
+            for offset, n in _chunks(buffer):
+                end = offset + _chunk_size(n)
+        if end < os.path.getsize(filename):
+            os.truncate(filename, end)
+
+        prompts = filename + ".prompts"
+        if os.path.exists(prompts):
+            with open(prompts, "rb") as f:
+                data = f.read()
+            if data and not data.endswith(b"\n"):
+                os.truncate(prompts, data.rfind(b"\n") + 1)
+        return False
+
+    def record(self, features, path=None, prompt=None, timestamp=None):
+        """
+        Queues one row.
+
+        Args:
+          features (dict): amplitude, spectral_centroid and frequency_bands.
+          path (str): The aesthetic path chosen for these features, if any.
+          prompt (str): The prompt generated from them, if any.
+          timestamp (float): Wall-clock time of the hop; now if omitted.
+        """
+        self._queue.put((time.time() if timestamp is None else timestamp, features, path, prompt))
+
+    def _run(self):
+        rows = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                row = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                row = False
+            if row:
+                rows.append(row)
+            now = time.monotonic()
+            if row is None or len(rows) >= self.chunk_rows or now >= deadline:
+                if rows:
+                    self._write_chunk(rows)
+                    rows = []
+                deadline = now + self.flush_interval
+            if row is None:
+                return
+
+    def _write_chunk(self, rows):
+        n = len(rows)
+        columns = {name: np.zeros((n, width) if width > 1 else n, dtype=dtype)
+                   for name, dtype, width in COLUMNS}
+        for i, (timestamp, features, path, prompt) in enumerate(rows):
+            columns["timestamp"][i] = timestamp
+            columns["amplitude"][i] = features.get("amplitude", 0)
+            columns["spectral_centroid"][i] = features.get("spectral_centroid", 0)
+            columns["frequency_bands"][i] = features.get("frequency_bands", [0] * NUM_BANDS)
+            paths = _mapping3().AESTHETIC_PATHS
+            columns["path"][i] = paths.index(path) if path in paths else NO_PATH
+            key = prompt_key(prompt)
+            columns["prompt_key"][i] = key
+            if key != NO_PROMPT and key not in self._known_prompts:
+                self._known_prompts.add(key)
+                self._prompts.write(json.dumps({"key": key, "prompt": prompt}) + "\n")
+
+        self._file.write(CHUNK_HEADER.pack(CHUNK_MAGIC, n))
+        written = 0
+        for name, _, _ in COLUMNS:
+            data = columns[name].tobytes()
+            self._file.write(data)
+            written += len(data)
+        self._file.write(b"\0" * (_chunk_size(n) - CHUNK_HEADER.size - written))
+        self._file.flush()
+        self._prompts.flush()
+
+    def close(self):
+        """Writes any queued rows and closes the file."""
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+        self._prompts.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Timeline:
+    """
+    Memory-mapped reader for a timeline file.
+
+    Opening only walks the chunk headers; column data is exposed as zero-copy
+    views into the map, so random access into long sessions is instant.
+    """
+
+    def __init__(self, filename):
+        self._file = open(filename, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, num_bands = FILE_HEADER.unpack_from(self._map, 0)
+        if magic != FILE_MAGIC or num_bands != NUM_BANDS:
+            raise ValueError(f"{filename} is not a feature timeline")
+
+        self.chunks = []  # dicts of column views, one per chunk
+        self._starts = []  # index of each chunk's first row
+        total = 0
+        for offset, n in _chunks(self._map):
+            column_offset = offset + CHUNK_HEADER.size
+            chunk = {}
+            for name, dtype, width in COLUMNS:
+                count = n * width
+                view = np.frombuffer(self._map, dtype=dtype, count=count, offset=column_offset)
+                chunk[name] = view.reshape(n, width) if width > 1 else view
+                column_offset += count * np.dtype(dtype).itemsize
+            self.chunks.append(chunk)
+            self._starts.append(total)
+            total += n
+        self._length = total
+
+        self.prompts = {}
+        if os.path.exists(filename + ".prompts"):
+            with open(filename + ".prompts") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.prompts[entry["key"]] = entry["prompt"]
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, i):
+        """Row i as (timestamp, features, path, prompt)."""
+        if i < 0:
+            i += self._length
+        if not 0 <= i < self._length:
+            raise IndexError(i)
+        c = bisect.bisect_right(self._starts, i) - 1
+        chunk, j = self.chunks[c], i - self._starts[c]
+        features = {
+            "amplitude": float(chunk["amplitude"][j]),
+            "spectral_centroid": float(chunk["spectral_centroid"][j]),
+            "frequency_bands": chunk["frequency_bands"][j].tolist(),
+        }
+        path_index = int(chunk["path"][j])
+        path = _mapping3().AESTHETIC_PATHS[path_index] if path_index != NO_PATH else None
+        prompt = self.prompts.get(int(chunk["prompt_key"][j]))
+        return float(chunk["timestamp"][j]), features, path, prompt
+
+    def column(self, name):
+        """One column across the whole session, concatenated into a single array."""
+        return np.concatenate([chunk[name] for chunk in self.chunks]) if self.chunks else np.array([])
+
+    def index_at(self, timestamp):
+        """Index of the last row recorded at or before timestamp."""
+        return max(0, int(np.searchsorted(self.column("timestamp"), timestamp, side="right")) - 1)
+
+    def replay(self, start=0, speed=1.0):
+        """
+        Yields rows from index start onwards, sleeping between them so they
+        arrive at the recorded pace scaled by speed (None replays without waiting).
+        """
+        previous = None
+        began = time.monotonic()
+        offset = 0.0
+        for i in range(start, self._length):
+            row = self[i]
+            if speed and previous is not None:
+                offset += (row[0] - previous) / speed
+                delay = began + offset - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            previous = row[0]
+            yield row
+
+    def close(self):
+        self.chunks = []
+        try:
+            self._map.close()
+        except BufferError:
+            pass  # a caller still holds a column view; the map is freed with it
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def map_features(features):
+    """Runs the mapping stage (the current mapping3) on replayed features; returns (path, prompt)."""
+    mapping3 = _mapping3()
+    path = mapping3.select_aesthetic_path(features)
+    return path, mapping3.generate_prompt(features, path_type=path)
+
+
+def differences(path, prompt, recorded_path, recorded_prompt):
+    """What the mapping stage now produces differently from the recording, as printable strings."""
+    changes = []
+    if recorded_path is not None and path != recorded_path:
+        changes.append(f"path was {recorded_path}")
+    if recorded_prompt and prompt != recorded_prompt:
+        changes.append(f"prompt was: {recorded_prompt}")
+    return changes
+
+
+def _record_synthetic(filename, rows):
+    """Records a session the way main3 does, from extract_features-like values (NumPy scalars, bus fields)."""
+    rng = np.random.default_rng(0)
+    with TimelineRecorder(filename, chunk_rows=64) as recorder:
+        for i in range(rows):
+            live = {
+                "amplitude": np.float32(rng.uniform(0, 0.5)),
+                "spectral_centroid": np.float64(rng.uniform(200, 8000)),
+                "frequency_bands": list(rng.uniform(0, 100, NUM_BANDS).astype(np.float32)),
+                "bpm": 128.0,
+            }
+            features = as_recorded(live)
+            path, prompt = map_features(features)
+            # Like main3: hops record only the path, generations the prompt too.
+            recorder.record(features, path, prompt if i % 4 == 0 else None, timestamp=float(i))
+
+
+def verify(filename=None, rows=200):
+    """
+    Replays a session through the mapping stage and counts the rows whose
+    path or prompt differs from the recording. Without a filename, a
+    synthetic session is recorded first, which checks that recording keeps
+    everything the mapping needs to reproduce itself.
+
+    Returns:
+      The number of rows that differ.
+    """
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        if filename is None:
+            filename = os.path.join(directory, "verify.vptl")
+            _record_synthetic(filename, rows)
+        with Timeline(filename) as timeline:
+            mismatches = 0
+            for _, features, recorded_path, recorded_prompt in timeline.replay(speed=None):
+                if differences(*map_features(features), recorded_path, recorded_prompt):
+                    mismatches += 1
+            total = len(timeline)
+    print(f"Record -> replay: {total - mismatches}/{total} rows matched")
+    return mismatches
+
+
+def main():
+    # Usage: python timeline.py replay FILE [SPEED] [generate]
+    #        python timeline.py verify [FILE]
+    # Replays a recorded session into the mapping (and optionally the
+    # diffusion) stage without any audio capture, reporting where the
+    # current mapping3 differs from the recording; verify only counts the
+    # differing rows (of a synthetic session if no file is given).
+    if sys.argv[1] == "verify":
+        sys.exit(1 if verify(*sys.argv[2:3]) else 0)
+
+    filename = sys.argv[2]
+    speed = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+    pipe = None
+    if "generate" in sys.argv[4:]:
+        import cv2
+        from generator import load_diffusion_model, generate_image
+        print("Loading diffusion model (this may take a few minutes)...")
+        pipe = load_diffusion_model()
+
+    changed = 0
+    with Timeline(filename) as timeline:
+        print(f"Replaying {len(timeline)} rows from {filename}")
+        for timestamp, features, recorded_path, recorded_prompt in timeline.replay(speed=speed or None):
+            path, prompt = map_features(features)
+            print(time.strftime("%H:%M:%S", time.localtime(timestamp)), path, prompt)
+            changes = differences(path, prompt, recorded_path, recorded_prompt)
+            if changes:
+                changed += 1
+                print("  (changed since recording; " + "; ".join(changes) + ")")
+            if pipe is not None:
+                image = generate_image(pipe, prompt, output_type="np")
+                cv2.imshow("Replayed Visuals", np.ascontiguousarray(image[:, :, ::-1]))
+                if cv2.waitKey(1) & 0xFF == ord("q"):
+                    break
+    print(f"{changed} rows map differently from the recording")
+
+
+if __name__ == "__main__":
+    main()
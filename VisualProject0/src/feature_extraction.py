@@ -12,7 +12,7 @@ def extract_features(audio_data, sr=22050):
     amplitude = np.abs(audio_np).mean()
 
     # Compute a mel-spectrogram
-    mel_spec = librosa.feature.melspectrogram(audio_np, sr=sr, n_mels=64)
+    mel_spec = librosa.feature.melspectrogram(y=audio_np, sr=sr, n_mels=64)
     mel_db = librosa.power_to_db(mel_spec, ref=np.max)
 
     # Compute spectral centroid (average over time)
@@ -21,5 +21,7 @@ def extract_features(audio_data, sr=22050):
     return {
         "amplitude": amplitude,
         "spectral_centroid": spectral_centroid,
-        # Optionally: include mel_db or other features
+        # Mean level of each mel band over the chunk in dB (lowest band first),
+        # not normalized per chunk, so loudness changes stay visible.
+        "mel_spectrum": librosa.power_to_db(mel_spec.mean(axis=1)),
     }
@@ -1,39 +1,164 @@
 # src/main.py
+import os
+import sys
 import cv2
+import numpy as np
 import time
 from audio_capture import get_audio_stream, CHUNK, RATE
 from feature_extraction import extract_features
-from mapping import map_amplitude_to_brightness, map_centroid_to_hue
-from visual_mods import adjust_brightness, adjust_hue
+import mapping
+import visual_modes
+from visual_modes import SpectrogramWaterfall
+from video_source import VideoSource
 
+# Seconds between decode/effect throughput reports when a video base layer is used.
+STATS_INTERVAL = 5.0
+# Shared modules (feature bus, hot reloading, streaming) live with the diffusion visualizer.
+VISUALS_SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Visuals", "src")
 
-def main():
-    # Load the base image from the assets
-    base_image = cv2.imread('../assets/images/base_image.jpg')
-    base_image = cv2.resize(base_image, (640, 480))
 
-    # Set up the audio stream
-    stream, p = get_audio_stream()
+def _use_visuals_src():
+    # Appended, and only when a shared module is needed, so this loop's own
+    # mapping and visual_modes always win over the diffusion loop's.
+    if VISUALS_SRC not in sys.path:
+        sys.path.append(VISUALS_SRC)
+
+
+def subscribe_to_bus(name):
+    """Subscribes to a feature bus run by VisualProject0/Visuals/src/feature_bus.py."""
+    _use_visuals_src()
+    from feature_bus import FeatureSubscriber
+    return FeatureSubscriber(name)
+
+
+def _check_mapping(module):
+    assert 0 <= module.map_amplitude_to_brightness(1500) <= 100, "brightness must stay within 0-100"
+    assert 0 <= module.map_centroid_to_hue(4000) <= 180, "hue must stay within 0-180"
+
+
+def watch_modules():
+    """A reloader for this loop's mapping and effect modules (see hot_reload.py)."""
+    _use_visuals_src()
+    from hot_reload import ModuleReloader, SMOKE_TESTS
+    # This loop's mapping module is not the prompt mapper the default test expects.
+    tests = {"mapping": _check_mapping, "visual_modes": SMOKE_TESTS["visual_modes"]}
+    return ModuleReloader("mapping", "visual_modes", tests=tests)
+
+
+def _call(name, function, *args):
+    """Calls a mapping or effect function directly, without a reloader."""
+    return getattr(sys.modules[name], function)(*args)
+
+
+def main(base_source=None, bus_name=None, waterfall=False, reload=False, stream_port=None,
+         stream_host="127.0.0.1"):
+    """
+    Runs the audio-reactive display.
+
+    Args:
+      base_source: None to use the static base image, or a video file, camera
+        index or V4L2 device ("/dev/video0") to use as a moving base layer.
+      bus_name (str): Read features from this shared feature bus instead of
+        opening and analysing an audio stream of our own.
+      waterfall (bool): Show a scrolling mel spectrogram instead of adjusting a base layer.
+      reload (bool): Reload mapping.py and visual_modes.py between frames when
+        they are saved; an edit that fails to load keeps the running version.
+      stream_port (int): Also stream the output to browsers and remote displays
+        from this port (see frame_server.py).
+      stream_host (str): Interface to stream on. The stream has no
+        authentication; "0.0.0.0" opens it to the local network.
+    """
+    reloader = watch_modules() if reload else None
+    call = reloader.call if reloader is not None else _call
+    server = None
+    if stream_port:
+        _use_visuals_src()
+        from frame_server import FrameServer
+        server = FrameServer(stream_host, stream_port)
+        print(f"Streaming at {server.url} (/stream.mjpg, /ws, /stats)")
+    video = None
+    spectrogram = None
+    if waterfall:
+        spectrogram = SpectrogramWaterfall(640, 480)
+    elif base_source is None:
+        # Load the base image from the assets
+        base_image = cv2.imread('../assets/images/base_image.jpg')
+        base_image = cv2.resize(base_image, (640, 480))
+    else:
+        video = VideoSource(base_source, size=(640, 480))
+        base_image = None
+
+    # Set up the audio stream, or subscribe to the shared analysis
+    stream = p = bus = None
+    if bus_name:
+        bus = subscribe_to_bus(bus_name)
+    else:
+        stream, p = get_audio_stream()
+
+    effect_frames = 0
+    effect_seconds = 0.0
+    last_report = time.monotonic()
 
     print("Starting audio-reactive visual display. Press 'q' to quit.")
     try:
         while True:
-            # Read a chunk of audio input
-            audio_data = stream.read(CHUNK, exception_on_overflow=False)
+            if reloader is not None:
+                reloader.check()
+            if bus is not None:
+                # Features were already computed once for every visualizer
+                features = bus.wait_next()
+                if features is None:
+                    continue
+            else:
+                # Read a chunk of audio input
+                audio_data = stream.read(CHUNK, exception_on_overflow=False)
 
-            # Extract relevant audio features
-            features = extract_features(audio_data, sr=RATE)
+                # Extract relevant audio features
+                features = extract_features(audio_data, sr=RATE)
 
             # Map features to visual transformation parameters
-            brightness_param = map_amplitude_to_brightness(features["amplitude"])
-            hue_param = map_centroid_to_hue(features["spectral_centroid"])
+            brightness_param = call("mapping", "map_amplitude_to_brightness", features["amplitude"])
+            hue_param = call("mapping", "map_centroid_to_hue", features["spectral_centroid"])
 
-            # Adjust base image based on the mapped parameters
-            mod_image = adjust_brightness(base_image, int(brightness_param - 50))
-            mod_image = adjust_hue(mod_image, hue_param)
+            if spectrogram is not None:
+                if "mel_spectrum" in features:
+                    spectrogram.push(features["mel_spectrum"])
+                else:
+                    # The feature bus only carries the 8 band powers.
+                    spectrogram.push(10 * np.log10(np.maximum(features["frequency_bands"], 1e-10)))
+                mod_image = spectrogram.frame()
+            elif video is not None:
+                # Never wait for the decoder: reuse the last frame if none is new.
+                base_image = video.latest()
+                if base_image is None:
+                    # Keep the window responsive (and 'q' working) while the source stalls.
+                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                        break
+                    continue
+                # Adjust the video frame in one HSV round trip to keep up with the stream.
+                start = time.perf_counter()
+                mod_image = call("visual_modes", "adjust_brightness_and_hue", base_image,
+                                 int(brightness_param - 50), hue_param)
+                effect_seconds += time.perf_counter() - start
+                effect_frames += 1
+                if time.monotonic() - last_report >= STATS_INTERVAL:
+                    stats = video.stats()
+                    print(f"Decode {stats['decode_fps']:.1f} fps "
+                          f"({stats['dropped']} dropped, {stats['stalls']} stalls), "
+                          f"effects {effect_frames / (time.monotonic() - last_report):.1f} fps "
+                          f"({1000 * effect_seconds / effect_frames:.2f} ms/frame)")
+                    effect_frames = 0
+                    effect_seconds = 0.0
+                    last_report = time.monotonic()
+            else:
+                # Adjust base image based on the mapped parameters
+                mod_image = call("visual_modes", "adjust_brightness", base_image, int(brightness_param - 50))
+                mod_image = call("visual_modes", "adjust_hue", mod_image, hue_param)
 
             # Display the modified image
             cv2.imshow('Audio-Reactive Visual', mod_image)
+            if server is not None:
+                server.publish(mod_image)
             if cv2.waitKey(1) & 0xFF == ord('q'):
                 break
 
@@ -43,11 +168,48 @@ def main():
         pass
     finally:
         # Clean-up: stop audio stream and close window
-        stream.stop_stream()
-        stream.close()
-        p.terminate()
+        if bus is not None:
+            bus.close()
+        else:
+            stream.stop_stream()
+            stream.close()
+            p.terminate()
+        if video is not None:
+            video.close()
+        if server is not None:
+            server.report()
+            server.close()
         cv2.destroyAllWindows()
 
 
 if __name__ == '__main__':
-    main()
+    # Optional base layer: python main.py [VIDEO_FILE | CAMERA_INDEX | /dev/videoN] [--bus NAME]
+    # Spectrogram waterfall instead: python main.py --waterfall [--bus NAME]
+    # Add --reload to pick up edits to mapping.py and visual_modes.py while running,
+    # and --stream PORT [--host 0.0.0.0] to serve the output to other screens
+    # (only on this machine unless --host is given).
+    args = sys.argv[1:]
+    reload = "--reload" in args
+    if reload:
+        args.remove("--reload")
+    stream_port = None
+    if "--stream" in args:
+        i = args.index("--stream")
+        stream_port = int(args[i + 1])
+        del args[i:i + 2]
+    stream_host = "127.0.0.1"
+    if "--host" in args:
+        i = args.index("--host")
+        stream_host = args[i + 1]
+        del args[i:i + 2]
+    waterfall = "--waterfall" in args
+    if waterfall:
+        args.remove("--waterfall")
+    bus_name = None
+    if "--bus" in args:
+        i = args.index("--bus")
+        bus_name = args[i + 1]
+        del args[i:i + 2]
+    source = args[0] if args else None
+    main(int(source) if source is not None and source.isdigit() else source, bus_name, waterfall, reload, stream_port,
+         stream_host)
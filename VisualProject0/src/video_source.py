@@ -0,0 +1,142 @@
+# src/video_source.py
+import threading
+import time
+
+import cv2
+import numpy as np
+
+MAX_FAILED_READS = 20  # consecutive failures after which a file source gives up
+MAX_BACKOFF = 1.0  # longest wait in seconds between failed reads
+
+
+class VideoSource:
+    """
+    Decodes a video file or camera on a background thread into a ring of
+    preallocated, already-resized frame buffers.
+
+    latest() never waits for the decoder: it returns the newest complete
+    frame (or the previous one if nothing new has arrived), so a slow or
+    stalled decode can never hold up the audio loop.
+
+    Args:
+      source: A file path, a camera index, or a V4L2 device such as "/dev/video0".
+      size (tuple): Output (width, height) of every frame.
+      ring_size (int): Number of frame buffers; at least 3, so the decoder always
+        has a free buffer besides the newest frame and the one being read.
+      loop (bool): Rewind files at the end instead of stopping; without it,
+        decoding stops at the end and latest() keeps returning the last frame. A file that
+        keeps failing to read even after rewinding is given up on (see stats()).
+      realtime (bool): Pace file decoding at the file's frame rate (cameras pace themselves).
+    """
+
+    def __init__(self, source, size=(640, 480), ring_size=4, loop=True, realtime=True):
+        self.source = source
+        self.size = size
+        self.loop = loop
+        width, height = size
+        self.ring = [np.zeros((height, width, 3), dtype=np.uint8) for _ in range(max(3, ring_size))]
+        self.decoded = 0
+        self.delivered = 0
+        self.stalls = 0
+        self.failed = False
+        self.ended = False
+
+        if isinstance(source, str) and source.startswith("/dev/video"):
+            self.capture = cv2.VideoCapture(source, cv2.CAP_V4L2)
+        else:
+            self.capture = cv2.VideoCapture(source)
+        if not self.capture.isOpened():
+            raise IOError(f"Could not open video source {source!r}")
+        self.is_file = isinstance(source, str) and not source.startswith("/dev/")
+        fps = self.capture.get(cv2.CAP_PROP_FPS)
+        self.frame_interval = 1.0 / fps if realtime and self.is_file and fps > 0 else 0.0
+
+        self._lock = threading.Lock()
+        self._newest = None  # index of the newest complete frame
+        self._reading = None  # index handed out by the last latest() call
+        self._fresh = False
+        self._stop_event = threading.Event()
+        self._started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _free_slot(self):
+        with self._lock:
+            busy = {self._newest, self._reading}
+        for i in range(len(self.ring)):
+            if i not in busy:
+                return i
+
+    def _run(self):
+        raw = None
+        next_time = time.monotonic()
+        failures = 0
+        while not self._stop_event.is_set():
+            ok, raw = self.capture.read(raw)
+            if not ok:
+                failures += 1
+                if self.is_file and not self.loop and self._at_end():
+                    self.ended = True  # a normal end of file, not a failed read
+                    return
+                if self.is_file and self.loop and failures == 1:
+                    self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    continue
+                self.stalls += 1
+                if self.is_file and failures >= MAX_FAILED_READS:
+                    # Rewinding did not help: the file yields no frames at all.
+                    print(f"Video source {self.source!r} stopped after {failures} failed reads")
+                    self.failed = True
+                    return
+                # Back off so a camera that stopped delivering doesn't spin a core.
+                time.sleep(min(0.01 * failures, MAX_BACKOFF))
+                continue
+            failures = 0
+            slot = self._free_slot()
+            cv2.resize(raw, self.size, dst=self.ring[slot], interpolation=cv2.INTER_AREA)
+            with self._lock:
+                self._newest = slot
+                self._fresh = True
+            self.decoded += 1
+            if self.frame_interval:
+                next_time += self.frame_interval
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_time = time.monotonic()
+
+    def _at_end(self):
+        """Whether a file has been read to its last frame (False if its length is unknown)."""
+        total = self.capture.get(cv2.CAP_PROP_FRAME_COUNT)
+        return total > 0 and self.capture.get(cv2.CAP_PROP_POS_FRAMES) >= total
+
+    def latest(self):
+        """
+        Returns the newest decoded frame without blocking, or None before the
+        first frame. The buffer stays untouched by the decoder until the next call.
+        """
+        with self._lock:
+            if self._newest is None:
+                return None
+            if self._fresh:
+                self.delivered += 1
+                self._fresh = False
+            self._reading = self._newest
+            return self.ring[self._reading]
+
+    def stats(self):
+        """Decode rate and how many decoded frames were never shown."""
+        elapsed = time.monotonic() - self._started
+        return {
+            "decode_fps": self.decoded / elapsed if elapsed else 0.0,
+            "decoded": self.decoded,
+            "dropped": self.decoded - self.delivered,
+            "stalls": self.stalls,
+            "failed": self.failed,
+            "ended": self.ended,
+        }
+
+    def close(self):
+        self._stop_event.set()
+        self._thread.join()
+        self.capture.release()
@@ -21,3 +21,86 @@ def adjust_hue(image, hue_shift):
     final_hsv = cv2.merge((h, s, v))
     image_hue = cv2.cvtColor(final_hsv, cv2.COLOR_HSV2BGR)
     return image_hue
+
+
+def adjust_brightness_and_hue(image, brightness_value, hue_shift):
+    """
+    Applies adjust_brightness and adjust_hue in a single HSV round trip.
+
+    Both adjustments are per-value lookups, so they run as 256-entry LUTs on
+    the H and V channels instead of converting to HSV and back twice.
+    """
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    h, s, v = cv2.split(hsv)
+    values = np.arange(256, dtype=np.int32)
+    v_lut = np.clip(values + int(brightness_value), 0, 255).astype(np.uint8)
+    h_lut = ((values + int(hue_shift)) % 180).astype(np.uint8)
+    final_hsv = cv2.merge((cv2.LUT(h, h_lut), s, cv2.LUT(v, v_lut)))
+    return cv2.cvtColor(final_hsv, cv2.COLOR_HSV2BGR)
+
+
+def colormap_lut(colormap=cv2.COLORMAP_INFERNO):
+    """A 256 x 3 BGR lookup table for one of OpenCV's colormaps."""
+    return cv2.applyColorMap(np.arange(256, dtype=np.uint8).reshape(256, 1), colormap).reshape(256, 3)
+
+
+class SpectrogramWaterfall:
+    """
+    A scrolling mel spectrogram: time runs right to left, low frequencies at the bottom.
+
+    Columns go into a circular image buffer instead of shifting the whole
+    image every frame. The buffer is twice the display width and each column
+    is written at both i and i + width, so the newest `width` columns are
+    always one contiguous window of it: frame() is a zero-copy view and a
+    push costs O(height), whatever the width.
+
+    Args:
+      width (int): Display width in pixels (the number of visible columns times column_width).
+      height (int): Display height in pixels; the mel bins are stretched to it.
+      column_width (int): Pixels each push scrolls by.
+      colormap (int): An OpenCV colormap, applied through a LUT.
+      db_range (float): Dynamic range shown below the running peak level.
+      peak_decay (float): dB per push the peak level falls back when the music gets quieter.
+    """
+
+    def __init__(self, width=640, height=480, column_width=2, colormap=cv2.COLORMAP_INFERNO,
+                 db_range=80.0, peak_decay=0.05):
+        self.width = width
+        self.height = height
+        self.column_width = column_width
+        self.lut = colormap_lut(colormap)
+        self.db_range = db_range
+        self.peak_decay = peak_decay
+        self.peak_db = None
+        self.ring = np.zeros((height, 2 * width, 3), dtype=np.uint8)
+        self.position = 0  # where the next column is written
+        self._bins = None
+        self._rows = None
+
+    def push(self, mel_db):
+        """Adds one spectrum column (mel band levels in dB, lowest band first)."""
+        mel_db = np.asarray(mel_db, dtype=np.float32)
+        if self._bins != len(mel_db):
+            # Output row -> mel bin, flipped so the lowest band is at the bottom.
+            self._bins = len(mel_db)
+            self._rows = (self.height - 1 - np.arange(self.height)) * self._bins // self.height
+        loudest = float(mel_db.max())
+        if self.peak_db is None or loudest > self.peak_db:
+            self.peak_db = loudest
+        else:
+            self.peak_db -= self.peak_decay
+        levels = (mel_db - (self.peak_db - self.db_range)) * (255.0 / self.db_range)
+        column = self.lut[np.clip(levels, 0, 255).astype(np.uint8)[self._rows]]
+
+        for _ in range(self.column_width):
+            self.ring[:, self.position] = column
+            self.ring[:, self.position + self.width] = column
+            self.position = (self.position + 1) % self.width
+
+    def slices(self):
+        """The display as two views of the ring, oldest columns first, for callers that blit them separately."""
+        return self.ring[:, self.position:self.width], self.ring[:, :self.position]
+
+    def frame(self):
+        """The display as a single zero-copy (height, width, 3) view, newest column on the right."""
+        return self.ring[:, self.position:self.position + self.width]
@@ -1,20 +1,15 @@
+import os
+import sys
 import numpy as np
 import pygame
 import sounddevice as sd
 import math
 import librosa  # For beat tracking
+from particle_sim import ParticleSimulation, grid_positions
 
 # Screen dimensions
 WIDTH, HEIGHT = 800, 600
 
-pygame.init()
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Techno Reactive Visuals (Black & White) - Librosa BPM")
-clock = pygame.time.Clock()
-
-# Setup a font to display BPM on screen.
-font = pygame.font.SysFont("Arial", 24)
-
 
 # Particle class representing each moving dot
 class Particle:
@@ -38,17 +33,33 @@ margin_y = HEIGHT * 0.1
 spacing_x = (WIDTH - 2 * margin_x) / (columns - 1) if columns > 1 else 0
 spacing_y = (HEIGHT - 2 * margin_y) / (rows - 1) if rows > 1 else 0
 
-particles = []
-for i in range(rows):
-    for j in range(columns):
-        if len(particles) < num_particles:
-            x = margin_x + j * spacing_x
-            y = margin_y + i * spacing_y
-            particles.append(Particle(x, y))
-
 gravity_centers = [np.array([WIDTH * (i + 0.5) / num_centers, HEIGHT / 2])
                    for i in range(num_centers)]
 
+# Multi-process simulation over shared memory (see particle_sim.py).
+# None keeps the original per-particle loop; 0 uses every core, 1 runs the
+# vectorized step in this process. Raise num_particles into the millions
+# when enabling it.
+sim_workers = None
+# Above this many particles, draw single pixels instead of circles and lines.
+max_drawn_lines = 1000
+
+# Name of a running feature bus (VisualProject0/Visuals/src/feature_bus.py) to
+# take BPM and low-frequency energy from, instead of opening an input stream
+# and running beat tracking here. None keeps the local analysis.
+feature_bus_name = None
+
+
+def draw_points(surface, positions, color=(255, 255, 255)):
+    """Plots every particle as one pixel straight into the surface's pixel array."""
+    xs = positions[:, 0].astype(np.intp)
+    ys = positions[:, 1].astype(np.intp)
+    np.clip(xs, 0, surface.get_width() - 1, out=xs)
+    np.clip(ys, 0, surface.get_height() - 1, out=ys)
+    pixels = pygame.surfarray.pixels2d(surface)
+    pixels[xs, ys] = surface.map_rgb(color)
+    del pixels  # unlock the surface
+
 # Global parameters for audio
 BUFFER_SIZE = 1024
 current_block = np.zeros(BUFFER_SIZE, dtype=np.float32)
@@ -66,90 +77,147 @@ def audio_callback(indata, frames, time, status):
     accumulated_audio.append(current_block.copy())
 
 
-# Use default input device (ensure your system default input is set to BlackHole if you want system output)
-stream = sd.InputStream(
-    callback=audio_callback,
-    channels=1,
-    samplerate=44100,
-    blocksize=BUFFER_SIZE,
-    device=None
-)
-stream.start()
-
-samplerate = 44100
-# We will use a window of 5 seconds for beat tracking
-min_duration = 10  # seconds
-min_samples = int(min_duration * samplerate)
-stable_bpm = 0
-
-# Particle reaction multiplier
-speed_multiplier = 7
-
-# For smoothing BPM readings
-bpm_history = []
-max_history = 100
-
-running = True
-while running:
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-
-    # --- BPM Detection using Librosa ---
-    # Concatenate accumulated blocks into one array
-    if accumulated_audio:
-        full_audio = np.concatenate(accumulated_audio)
-        if full_audio.shape[0] >= min_samples:
-            # Run beat tracking on the last 5 seconds of audio
-            y_segment = full_audio[-min_samples:]
-            tempo, beats = librosa.beat.beat_track(y=y_segment, sr=samplerate)
-            if tempo > 0:
-                bpm_history.append(tempo)
-                if len(bpm_history) > max_history:
-                    bpm_history.pop(0)
-            # Use the average of bpm_history as the stable BPM value,
-            # converting it to a float so it formats correctly.
-            stable_bpm = float(np.mean(bpm_history)) if bpm_history else 0
-            # Remove older data to keep the buffer size bounded (keep only last 5 seconds)
-            if full_audio.shape[0] > min_samples:
-                full_audio = full_audio[-min_samples:]
-                # Re-split into blocks of BUFFER_SIZE samples
-                accumulated_audio = [full_audio[i:i + BUFFER_SIZE]
-                                     for i in range(0, full_audio.shape[0], BUFFER_SIZE)]
-
-    # --- Audio Processing for Visual Effects (unfiltered) ---
-    fft_result = np.fft.fft(current_block)
-    fft_magnitude = np.abs(fft_result[:BUFFER_SIZE // 2])
-    low_freq_bins = fft_magnitude[1:5]
-    low_energy = np.mean(low_freq_bins)
-    pull_factor = 1 + (low_energy / 500.0)
-
-    # --- Update Particles ---
-    for p in particles:
-        total_force = np.array([0.0, 0.0])
-        for gc in gravity_centers:
-            direction = gc - p.pos
-            distance = np.linalg.norm(direction) + 1e-5
-            force = pull_factor * speed_multiplier * direction / (distance ** 2)
-            total_force += force
-        p.update(total_force, dt=1)
-        p.pos[0] %= WIDTH
-        p.pos[1] %= HEIGHT
-
-    # --- Drawing ---
-    screen.fill((0, 0, 0))
-    for gc in gravity_centers:
-        pygame.draw.circle(screen, (255, 255, 255), (int(gc[0]), int(gc[1])), 5)
-    for p in particles:
-        pygame.draw.circle(screen, (255, 255, 255), (int(p.pos[0]), int(p.pos[1])), 2)
+# Guarded so the physics worker processes can import this script.
+if __name__ == "__main__":
+    pygame.init()
+    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption("Techno Reactive Visuals (Black & White) - Librosa BPM")
+    clock = pygame.time.Clock()
+
+    # Setup a font to display BPM on screen.
+    font = pygame.font.SysFont("Arial", 24)
+
+    simulation = None
+    particles = []
+    if sim_workers is None:
+        for i in range(rows):
+            for j in range(columns):
+                if len(particles) < num_particles:
+                    x = margin_x + j * spacing_x
+                    y = margin_y + i * spacing_y
+                    particles.append(Particle(x, y))
+    else:
+        simulation = ParticleSimulation(grid_positions(num_particles, WIDTH, HEIGHT),
+                                        gravity_centers, WIDTH, HEIGHT,
+                                        num_workers=sim_workers or None)
+
+    stream = bus = None
+    if feature_bus_name:
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                     "..", "VisualProject0", "Visuals", "src"))
+        from feature_bus import FeatureSubscriber
+        bus = FeatureSubscriber(feature_bus_name)
+    else:
+        # Use default input device (ensure your system default input is set to BlackHole if you want system output)
+        stream = sd.InputStream(
+            callback=audio_callback,
+            channels=1,
+            samplerate=44100,
+            blocksize=BUFFER_SIZE,
+            device=None
+        )
+        stream.start()
+
+    samplerate = 44100
+    # We will use a window of 5 seconds for beat tracking
+    min_duration = 10  # seconds
+    min_samples = int(min_duration * samplerate)
+    stable_bpm = 0
+
+    # Particle reaction multiplier
+    speed_multiplier = 7
+
+    # For smoothing BPM readings
+    bpm_history = []
+    max_history = 100
+
+    running = True
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+
+        if bus is not None:
+            # BPM and low-frequency energy come from the shared analysis process.
+            features = bus.latest()
+            if features is not None:
+                stable_bpm = features["bpm"]
+                low_energy = features["low_energy"]
+            else:
+                low_energy = 0.0
+        else:
+            # --- BPM Detection using Librosa ---
+            # Concatenate accumulated blocks into one array
+            if accumulated_audio:
+                full_audio = np.concatenate(accumulated_audio)
+                if full_audio.shape[0] >= min_samples:
+                    # Run beat tracking on the last 5 seconds of audio
+                    y_segment = full_audio[-min_samples:]
+                    tempo, beats = librosa.beat.beat_track(y=y_segment, sr=samplerate)
+                    if tempo > 0:
+                        bpm_history.append(tempo)
+                        if len(bpm_history) > max_history:
+                            bpm_history.pop(0)
+                    # Use the average of bpm_history as the stable BPM value,
+                    # converting it to a float so it formats correctly.
+                    stable_bpm = float(np.mean(bpm_history)) if bpm_history else 0
+                    # Remove older data to keep the buffer size bounded (keep only last 5 seconds)
+                    if full_audio.shape[0] > min_samples:
+                        full_audio = full_audio[-min_samples:]
+                        # Re-split into blocks of BUFFER_SIZE samples
+                        accumulated_audio = [full_audio[i:i + BUFFER_SIZE]
+                                             for i in range(0, full_audio.shape[0], BUFFER_SIZE)]
+
+            # --- Audio Processing for Visual Effects (unfiltered) ---
+            fft_result = np.fft.fft(current_block)
+            fft_magnitude = np.abs(fft_result[:BUFFER_SIZE // 2])
+            low_freq_bins = fft_magnitude[1:5]
+            low_energy = np.mean(low_freq_bins)
+        pull_factor = 1 + (low_energy / 500.0)
+
+        # --- Update Particles ---
+        if simulation is not None:
+            # Workers compute the next frame into the back buffer while the
+            # current one is drawn from the front buffer below.
+            positions = simulation.positions
+            simulation.begin_step(pull_factor, speed_multiplier, dt=1)
+        for p in particles:
+            total_force = np.array([0.0, 0.0])
+            for gc in gravity_centers:
+                direction = gc - p.pos
+                distance = np.linalg.norm(direction) + 1e-5
+                force = pull_factor * speed_multiplier * direction / (distance ** 2)
+                total_force += force
+            p.update(total_force, dt=1)
+            p.pos[0] %= WIDTH
+            p.pos[1] %= HEIGHT
+
+        # --- Drawing ---
+        screen.fill((0, 0, 0))
         for gc in gravity_centers:
-            pygame.draw.aaline(screen, (255, 255, 255),
-                               (int(p.pos[0]), int(p.pos[1])),
-                               (int(gc[0]), int(gc[1])))
-    bpm_text = font.render(f"BPM: {stable_bpm:.2f}", True, (255, 255, 255))
-    screen.blit(bpm_text, (10, 10))
-    pygame.display.flip()
-    clock.tick(60)
-
-stream.stop()
-pygame.quit()
\ No newline at end of file
+            pygame.draw.circle(screen, (255, 255, 255), (int(gc[0]), int(gc[1])), 5)
+        if simulation is not None and num_particles > max_drawn_lines:
+            draw_points(screen, positions)
+        else:
+            points = positions if simulation is not None else [p.pos for p in particles]
+            for pos in points:
+                pygame.draw.circle(screen, (255, 255, 255), (int(pos[0]), int(pos[1])), 2)
+                for gc in gravity_centers:
+                    pygame.draw.aaline(screen, (255, 255, 255),
+                                       (int(pos[0]), int(pos[1])),
+                                       (int(gc[0]), int(gc[1])))
+        if simulation is not None:
+            del positions  # the front buffer is about to be swapped
+            simulation.end_step()
+        bpm_text = font.render(f"BPM: {stable_bpm:.2f}", True, (255, 255, 255))
+        screen.blit(bpm_text, (10, 10))
+        pygame.display.flip()
+        clock.tick(60)
+
+    if bus is not None:
+        bus.close()
+    else:
+        stream.stop()
+    if simulation is not None:
+        simulation.close()
+    pygame.quit()
\ No newline at end of file
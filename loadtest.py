@@ -0,0 +1,392 @@
+"""
+End-to-end load test for the render loops.
+
+Runs the real entry points -- the hue/brightness loop (VisualProject0/src/main.py),
+the diffusion loop (VisualProject0/Visuals/src/main.py) and the particle visualizer
+(Visuals/Main code.py) -- from synthetic or file audio, with headless display
+stubs and a stub diffusion pipeline, either as fast as possible or at N x real
+time. Each scenario runs in its own process and reports sustained throughput,
+latency percentiles and memory growth.
+
+Usage:
+  python loadtest.py [hue|diffusion|particles|all] [--speed N] [--frames N]
+                     [--duration SECONDS] [--audio FILE] [--video FILE]
+                     [--step-seconds S]
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import queue
+import runpy
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = {
+    "hue": os.path.join(ROOT, "VisualProject0", "src"),
+    "diffusion": os.path.join(ROOT, "VisualProject0", "Visuals", "src"),
+    "particles": os.path.join(ROOT, "Visuals"),
+}
+
+_real_sleep = time.sleep
+
+
+def current_rss():
+    """Resident set size of this process in bytes (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+
+
+class SyntheticAudio:
+    """A kick on every beat, off-beat hats and a bass tone, so tempo and band features have something to find."""
+
+    def __init__(self, sr, bpm=128, seed=0):
+        self.sr = sr
+        self.period = int(sr * 60 / bpm)
+        self.position = 0
+        self.rng = np.random.default_rng(seed)
+
+    def read(self, n):
+        t = self.position + np.arange(n)
+        self.position += n
+        in_beat = (t % self.period) / self.sr
+        off_beat = ((t + self.period // 2) % self.period) / self.sr
+        kick = np.exp(-in_beat * 30) * np.sin(2 * np.pi * 55 * in_beat)
+        hats = np.exp(-off_beat * 80) * self.rng.standard_normal(n) * 0.3
+        bass = 0.2 * np.sin(2 * np.pi * 110 * t / self.sr)
+        return (0.6 * kick + hats + bass).astype(np.float32)
+
+
+class FileAudio:
+    """Loops an audio file, resampled to the stream rate."""
+
+    def __init__(self, path, sr):
+        import librosa
+        self.samples, _ = librosa.load(path, sr=sr, mono=True)
+        self.position = 0
+
+    def read(self, n):
+        index = (self.position + np.arange(n)) % len(self.samples)
+        self.position += n
+        return self.samples[index].astype(np.float32)
+
+
+class Metrics:
+    """Frame timings, per-frame latencies and RSS samples for one scenario."""
+
+    def __init__(self, speed, frames, duration, rss_every=50):
+        self.speed = speed
+        self.max_frames = frames
+        self.duration = duration
+        self.rss_every = rss_every
+        self.start = time.perf_counter()
+        self.frames = 0
+        self.latencies = []
+        self.rss = [(0, current_rss())]
+        self.audio_seconds = 0.0
+
+    def frame(self, latency):
+        self.frames += 1
+        self.latencies.append(latency)
+        if self.frames % self.rss_every == 0:
+            self.rss.append((self.frames, current_rss()))
+
+    def done(self):
+        if self.max_frames and self.frames >= self.max_frames:
+            return True
+        return bool(self.duration) and time.perf_counter() - self.start >= self.duration
+
+    def pace(self, audio_seconds):
+        """At N x real time, waits until the wall clock catches up with the audio clock."""
+        self.audio_seconds = audio_seconds
+        if self.speed:
+            delay = self.start + audio_seconds / self.speed - time.perf_counter()
+            if delay > 0:
+                _real_sleep(delay)
+
+    def report(self, name):
+        wall = time.perf_counter() - self.start
+        latencies = np.array(self.latencies) * 1000
+        frames, rss = np.array(self.rss, dtype=float).T
+        # Growth is fitted over the second half so warm-up allocations don't count as leaks.
+        half = len(frames) // 2
+        growth = 0.0
+        if len(frames) - half >= 2 and frames[-1] > frames[half]:
+            growth = np.polyfit(frames[half:], rss[half:], 1)[0] * 1000 / 2 ** 20
+        return {
+            "scenario": name,
+            "frames": self.frames,
+            "wall_seconds": round(wall, 3),
+            "fps": round(self.frames / wall, 2) if wall else 0.0,
+            "realtime_factor": round(self.audio_seconds / wall, 2) if wall else 0.0,
+            # None when the scenario produced no frames: there is nothing to take percentiles of.
+            "latency_ms": {q: round(float(np.percentile(latencies, p)), 2)
+                           for q, p in (("p50", 50), ("p90", 90), ("p99", 99), ("max", 100))}
+                          if len(latencies) else None,
+            "rss_mb": {"start": round(rss[0] / 2 ** 20, 1), "end": round(rss[-1] / 2 ** 20, 1),
+                       "peak": round(rss.max() / 2 ** 20, 1)},
+            "rss_growth_mb_per_1k_frames": round(float(growth), 3),
+        }
+
+
+class FakePyAudioStream:
+    """Stands in for a PyAudio input stream, producing 16-bit PCM from an audio source."""
+
+    def __init__(self, source, sr, metrics):
+        self.source = source
+        self.sr = sr
+        self.metrics = metrics
+        self.samples = 0
+        self.last_read = time.perf_counter()
+
+    def read(self, n, exception_on_overflow=True):
+        self.samples += n
+        self.metrics.pace(self.samples / self.sr)
+        data = (np.clip(self.source.read(n), -1, 1) * 32767).astype(np.int16).tobytes()
+        self.last_read = time.perf_counter()
+        return data
+
+    def stop_stream(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _patch_cv2(metrics, stream, quit_key):
+    """Headless cv2: imshow records the latency since the last audio read, waitKey quits when done."""
+    import cv2
+
+    real_imread = cv2.imread
+
+    def imread(path, *args):
+        image = real_imread(path, *args)
+        if image is None:  # missing asset: use a synthetic gradient instead
+            image = np.zeros((480, 640, 3), dtype=np.uint8)
+            image[..., 0] = np.linspace(0, 255, 640, dtype=np.uint8)
+            image[..., 1] = np.linspace(0, 255, 480, dtype=np.uint8)[:, None]
+            image[..., 2] = 128
+        return image
+
+    cv2.imread = imread
+    cv2.imshow = lambda window, image: metrics.frame(time.perf_counter() - stream.last_read)
+    cv2.waitKey = lambda delay=0: ord("q") if metrics.done() else quit_key
+    cv2.destroyAllWindows = lambda: None
+    cv2.namedWindow = lambda *args, **kwargs: None
+
+
+def run_hue(metrics, source_factory, options):
+    import audio_capture
+
+    stream = FakePyAudioStream(source_factory(audio_capture.RATE), audio_capture.RATE, metrics)
+    audio_capture.get_audio_stream = lambda: (stream, SimpleNamespace(terminate=lambda: None))
+    _patch_cv2(metrics, stream, quit_key=-1)
+
+    import main
+    # The loop's fixed 10 ms delay is scaled like everything else. Only the
+    # hue loop module sees the scaled clock; the video reader and the rest of
+    # the process keep the real time.sleep.
+    sleep = (lambda s: _real_sleep(s / metrics.speed)) if metrics.speed else (lambda s: None)
+    main.time = SimpleNamespace(**{**vars(time), "sleep": sleep})
+    try:
+        main.main(options.video)
+    finally:
+        main.time = time
+
+
+class StubPipeline:
+    """
+    Stands in for StableDiffusionPipeline: returns a gradient image after
+    step_seconds per step (scaled by the run speed), so the loop around the
+    model is exercised without loading weights.
+    """
+
+    def __init__(self, step_seconds, speed):
+        self.step_seconds = step_seconds
+        self.speed = speed
+
+    def __call__(self, prompt, num_inference_steps=50, guidance_scale=7.5, output_type="pil",
+                 width=512, height=512, **kwargs):
+        delay = self.step_seconds * num_inference_steps
+        if delay and self.speed:
+            _real_sleep(delay / self.speed)
+        image = np.linspace(0, 1, width * height * 3, dtype=np.float32).reshape(height, width, 3)
+        if output_type == "pil":
+            image = (image * 255).astype(np.uint8)  # an array converts like a PIL image
+        return SimpleNamespace(images=[image])
+
+
+def run_diffusion(metrics, source_factory, options):
+    import audio_capture
+    import generator
+
+    stream = FakePyAudioStream(source_factory(audio_capture.RATE), audio_capture.RATE, metrics)
+    audio_capture.get_audio_stream = lambda: (stream, SimpleNamespace(terminate=lambda: None))
+    generator.load_diffusion_model = lambda *args, **kwargs: StubPipeline(options.step_seconds,
+                                                                          metrics.speed)
+    _patch_cv2(metrics, stream, quit_key=ord(" "))
+
+    import main
+    main.main()
+
+
+def run_particles(metrics, source_factory, options):
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+    import pygame
+    import sounddevice
+
+    streams = []
+
+    class FakeInputStream:
+        def __init__(self, callback, channels=1, samplerate=44100, blocksize=1024, **kwargs):
+            self.callback = callback
+            self.channels = channels
+            self.samplerate = samplerate
+            self.blocksize = blocksize
+            self.source = source_factory(samplerate)
+            self.samples = 0
+            streams.append(self)
+
+        def start(self):
+            pass
+
+        def stop(self):
+            pass
+
+        def deliver(self, until_seconds):
+            """Calls the audio callback for every block due by the given audio time."""
+            while self.samples + self.blocksize <= until_seconds * self.samplerate:
+                block = self.source.read(self.blocksize)
+                indata = np.repeat(block[:, None], self.channels, axis=1)
+                self.callback(indata, self.blocksize, None, None)
+                self.samples += self.blocksize
+
+    class FakeClock:
+        """Replaces pygame's clock: counts frames, advances audio by one frame period and paces the run."""
+
+        def __init__(self):
+            self.frame_start = time.perf_counter()
+            self.audio_seconds = 0.0
+
+        def tick(self, fps=60):
+            metrics.frame(time.perf_counter() - self.frame_start)
+            self.audio_seconds += 1.0 / fps
+            metrics.pace(self.audio_seconds)
+            for stream in streams:
+                stream.deliver(self.audio_seconds)
+            self.frame_start = time.perf_counter()
+            return 0
+
+    real_get = pygame.event.get
+
+    def get_events(*args, **kwargs):
+        events = real_get(*args, **kwargs)
+        if metrics.done():
+            events.append(pygame.event.Event(pygame.QUIT))
+        return events
+
+    sounddevice.InputStream = FakeInputStream
+    pygame.time.Clock = FakeClock
+    pygame.event.get = get_events
+    runpy.run_path(os.path.join(SCENARIOS["particles"], "Main code.py"), run_name="__main__")
+
+
+RUNNERS = {"hue": run_hue, "diffusion": run_diffusion, "particles": run_particles}
+
+
+def _scenario_process(name, options, results):
+    """Child process entry point: isolates one scenario's flat imports and patches."""
+    directory = SCENARIOS[name]
+    sys.path.insert(0, directory)
+    os.chdir(directory)
+    if options.audio:
+        source_factory = lambda sr: FileAudio(options.audio, sr)
+    else:
+        source_factory = SyntheticAudio
+    frames = options.frames if options.frames is not None else (20 if name == "diffusion" else 2000)
+    metrics = Metrics(options.speed, frames, options.duration)
+    try:
+        RUNNERS[name](metrics, source_factory, options)
+        results.put(metrics.report(name))
+    except Exception as e:
+        results.put({"scenario": name, "error": f"{type(e).__name__}: {e}", **metrics.report(name)})
+
+
+def run(names, options):
+    ctx = mp.get_context("spawn")
+    reports = []
+    for name in names:
+        results = ctx.Queue()
+        process = ctx.Process(target=_scenario_process, args=(name, options, results))
+        process.start()
+        while True:
+            try:
+                report = results.get(timeout=1.0)
+                break
+            except queue.Empty:
+                if not process.is_alive():
+                    report = {"scenario": name, "error": f"process exited with code {process.exitcode}"}
+                    break
+        process.join()
+        reports.append(report)
+    return reports
+
+
+def print_report(report):
+    print(f"== {report['scenario']}" + (f"  ERROR: {report['error']}" if "error" in report else ""))
+    if "frames" not in report:
+        return
+    latency = report["latency_ms"]
+    rss = report["rss_mb"]
+    print(f"  {report['frames']} frames in {report['wall_seconds']} s: {report['fps']} fps, "
+          f"{report['realtime_factor']}x real time")
+    if latency is None:
+        print("  no frames were rendered, so there are no latencies to report")
+        return
+    print(f"  latency ms: p50 {latency['p50']}  p90 {latency['p90']}  p99 {latency['p99']}  "
+          f"max {latency['max']}")
+    print(f"  RSS MB: start {rss['start']}  end {rss['end']}  peak {rss['peak']}  "
+          f"growth {report['rss_growth_mb_per_1k_frames']} MB / 1k frames")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Faster-than-real-time load test for the render loops.")
+    parser.add_argument("scenario", nargs="?", default="all", choices=list(SCENARIOS) + ["all"])
+    parser.add_argument("--speed", type=float, default=0,
+                        help="multiple of real time; 0 runs as fast as possible (default)")
+    parser.add_argument("--frames", type=int, default=None,
+                        help="frames (images for diffusion) per scenario")
+    parser.add_argument("--duration", type=float, default=None, help="wall-clock seconds per scenario")
+    parser.add_argument("--audio", default=None, help="audio file to loop instead of synthetic audio")
+    parser.add_argument("--video", default=None,
+                        help="looping video file used as the hue loop's base layer")
+    parser.add_argument("--step-seconds", type=float, default=0.0,
+                        help="simulated seconds per diffusion step for the stub pipeline")
+    parser.add_argument("--json", action="store_true", help="print the reports as JSON")
+    options = parser.parse_args()
+    # Scenarios run from their own directories, so resolve paths against ours first.
+    for name in ("audio", "video"):
+        if getattr(options, name):
+            setattr(options, name, os.path.abspath(getattr(options, name)))
+
+    names = list(SCENARIOS) if options.scenario == "all" else [options.scenario]
+    reports = run(names, options)
+    if options.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        for report in reports:
+            print_report(report)
+
+
+if __name__ == "__main__":
+    main()